@@ -1,25 +1,90 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import Timestamp
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.read_preferences import Nearest, Primary, SecondaryPreferred
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, ExecutionTimeout, OperationFailure
+import io
 import os
+import re
+import sys
+import gzip
+import base64
+import json
+import queue
+import random
+import asyncio
+import threading
+import math
+import time
+import heapq
+import bisect
+import shutil
+import hashlib
+import hmac
 import logging
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from urllib.parse import urlparse
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter
+from typing import Awaitable, Callable, Dict, FrozenSet, Hashable, List, Optional, Set, Tuple, TypeVar
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
+import requests
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = 40_000_000
+except ImportError:
+    Image = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+MONGO_READ_DEADLINE_MS = int(os.environ.get('MONGO_READ_DEADLINE_MS', '2000'))
+MONGO_WRITE_DEADLINE_MS = int(os.environ.get('MONGO_WRITE_DEADLINE_MS', '5000'))
+MONGO_BACKGROUND_DEADLINE_MS = int(os.environ.get('MONGO_BACKGROUND_DEADLINE_MS', '60000'))
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=MONGO_WRITE_DEADLINE_MS)
 db = client[os.environ['DB_NAME']]
 
+# Catalog and comment reads may be served by secondaries; auth lookups and
+# writes always use `db` (primary). Clients that just wrote echo the write's
+# signed operation time back so their next read waits for it on the
+# secondary. Tokens older than the max staleness are ignored: every eligible
+# secondary has that write already.
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))
+READ_AFTER_HEADER = "X-Read-After"
+READ_PREFERENCES = {
+    "primary": lambda: Primary(),
+    "secondaryPreferred": lambda: SecondaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+    "nearest": lambda: Nearest(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+}
+READ_ROUTING_ENABLED = MONGO_READ_PREFERENCE != "primary"
+read_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=READ_PREFERENCES[MONGO_READ_PREFERENCE]()
+)
+
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
@@ -74,6 +139,14 @@ class GameHeroUpdate(BaseModel):
     image_url: Optional[str] = None
     official_link: Optional[str] = None
 
+class SearchResults(BaseModel):
+    items: List[GameHero]
+    total: int
+    # False when total is a lower bound ("N+") because counting stopped early.
+    total_exact: bool = True
+    page: int
+    limit: int
+
 class Comment(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -89,6 +162,1427 @@ class CommentCreate(BaseModel):
     category: str
     text: str
 
+class ProfilingSettings(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    started_at: datetime
+    duration_ms: Optional[float]
+    samples: int
+
+T = TypeVar("T")
+
+class Metrics:
+    # Minimal counter/gauge registry rendered in the Prometheus text format.
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self.gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def render(self) -> str:
+        lines = []
+        for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+            seen = set()
+            for (name, labels), value in sorted(series.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+MONGO_FAILURE_ERRORS = (asyncio.TimeoutError, ConnectionFailure, ExecutionTimeout)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._export_state()
+
+    def _export_state(self):
+        for state in (self.CLOSED, self.OPEN, self.HALF_OPEN):
+            metrics.set("circuit_breaker_state", 1 if state == self.state else 0, breaker=self.name, state=state)
+
+    def _transition(self, state: str):
+        metrics.inc("circuit_breaker_transitions_total", breaker=self.name, from_state=self.state, to_state=state)
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+        self._export_state()
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                metrics.inc("circuit_breaker_rejections_total", breaker=self.name)
+                raise CircuitOpenError(self.name)
+            self._transition(self.HALF_OPEN)
+        trial = self.state == self.HALF_OPEN
+        if trial:
+            if self.trial_in_flight:
+                metrics.inc("circuit_breaker_rejections_total", breaker=self.name)
+                raise CircuitOpenError(self.name)
+            self.trial_in_flight = True
+        try:
+            result = await fn()
+        except MONGO_FAILURE_ERRORS:
+            self.failures += 1
+            if trial or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._transition(self.OPEN)
+            raise
+        finally:
+            if trial:
+                self.trial_in_flight = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+        return result
+
+mongo_breaker = CircuitBreaker(
+    "mongo",
+    failure_threshold=int(os.environ.get('MONGO_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.environ.get('MONGO_BREAKER_RESET_SECONDS', '10'))
+)
+# Background jobs get their own breaker so their slow scans never open the
+# one that guards user requests.
+background_breaker = CircuitBreaker(
+    "mongo_background",
+    failure_threshold=int(os.environ.get('MONGO_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.environ.get('MONGO_BACKGROUND_BREAKER_RESET_SECONDS', '60'))
+)
+
+# Per-request accumulator of time spent awaiting Mongo, set by AccessLogMiddleware.
+mongo_time: ContextVar[Optional[List[float]]] = ContextVar("mongo_time", default=None)
+
+async def mongo(operation: Callable[[], Awaitable[T]], write: bool = False, background: bool = False) -> T:
+    if background:
+        deadline = MONGO_BACKGROUND_DEADLINE_MS / 1000
+        breaker = background_breaker
+    else:
+        deadline = (MONGO_WRITE_DEADLINE_MS if write else MONGO_READ_DEADLINE_MS) / 1000
+        breaker = mongo_breaker
+    started = time.perf_counter()
+    try:
+        return await breaker.call(lambda: asyncio.wait_for(operation(), deadline))
+    finally:
+        elapsed = mongo_time.get()
+        if elapsed is not None:
+            elapsed[0] += time.perf_counter() - started
+
+SEARCH_FIELD_WEIGHTS = {"title": 3, "description": 1}
+SEARCH_TOKEN_RE = re.compile(r"\w+")
+# Text-search matches counted per query; beyond it the total is reported as
+# a lower bound, so broad queries cost no more than narrow ones.
+SEARCH_COUNT_LIMIT = int(os.environ.get('SEARCH_COUNT_LIMIT', '1000'))
+
+def tokenize(text: str) -> List[str]:
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return SEARCH_TOKEN_RE.findall(normalized)
+
+class SearchIndex:
+    # In-process fallback for deployments where the Mongo text index is
+    # unavailable. Postings are partitioned by category so a query only
+    # touches the lists of its own category.
+    def __init__(self):
+        self.enabled = False
+        self.postings: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(dict))
+        self.doc_terms: Dict[str, Set[str]] = {}
+        self.docs: Dict[str, dict] = {}
+
+    def add(self, item: dict):
+        if not self.enabled:
+            return
+        self.remove(item['id'])
+        weights: Dict[str, int] = defaultdict(int)
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            for term in tokenize(item.get(field) or ""):
+                weights[term] += weight
+        category_postings = self.postings[item['category']]
+        for term, weight in weights.items():
+            category_postings[term][item['id']] = weight
+        self.doc_terms[item['id']] = set(weights)
+        self.docs[item['id']] = dict(item)
+
+    def remove(self, item_id: str):
+        doc = self.docs.pop(item_id, None)
+        if doc is None:
+            return
+        category_postings = self.postings[doc['category']]
+        for term in self.doc_terms.pop(item_id, ()):
+            posting = category_postings.get(term)
+            if posting is not None:
+                posting.pop(item_id, None)
+                if not posting:
+                    del category_postings[term]
+
+    def search(self, query: str, category: str, skip: int, limit: int) -> Tuple[List[dict], int]:
+        category_postings = self.postings.get(category, {})
+        doc_count = max(len(self.docs), 1)
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = category_postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + doc_count / len(posting))
+            for item_id, weight in posting.items():
+                scores[item_id] += weight * idf
+        top = heapq.nlargest(skip + limit, scores.items(), key=lambda kv: kv[1])[skip:]
+        return [dict(self.docs[item_id]) for item_id, _ in top], len(scores)
+
+search_index = SearchIndex()
+
+TRENDING_HALF_LIFE_SECONDS = float(os.environ.get('TRENDING_HALF_LIFE_SECONDS', str(6 * 3600)))
+TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K', '50'))
+TRENDING_MAX_TRACKED = int(os.environ.get('TRENDING_MAX_TRACKED', '10000'))
+TRENDING_MAX_CATEGORIES = int(os.environ.get('TRENDING_MAX_CATEGORIES', '20'))
+TRENDING_MAX_PENDING_VIEWS = int(os.environ.get('TRENDING_MAX_PENDING_VIEWS', '5000'))
+TRENDING_FLUSH_SECONDS = float(os.environ.get('TRENDING_FLUSH_SECONDS', '30'))
+TRENDING_WEIGHTS = {"view": 1.0, "comment": 5.0}
+ITEM_CATEGORIES = frozenset(
+    category.strip() for category in os.environ.get('ITEM_CATEGORIES', 'games,heroes').split(',') if category.strip()
+)
+
+class TrendingTracker:
+    # Forward-decayed scores: an event at time t adds
+    # weight * exp(decay * (t - landmark)), so comparing stored scores is the
+    # same as comparing scores decayed to now, and an item only moves up the
+    # ranking through its own events. That keeps each category's top-K exact
+    # with an O(K) update per event. At most max_tracked items in at most
+    # max_categories categories are scored; the lowest scores outside every
+    # top-K are pruned first, then the lowest overall. Once max_pending_views
+    # distinct items wait for $inc, flush_needed wakes the flush loop early.
+    def __init__(
+        self,
+        half_life: float,
+        top_k: int,
+        max_tracked: int,
+        max_categories: int = TRENDING_MAX_CATEGORIES,
+        max_pending_views: int = TRENDING_MAX_PENDING_VIEWS
+    ):
+        self.decay = math.log(2) / half_life
+        self.top_k = top_k
+        self.max_tracked = max_tracked
+        self.max_categories = max_categories
+        self.max_pending_views = max_pending_views
+        self.landmark = time.time()
+        self.scores: Dict[str, Dict[str, float]] = {}
+        self.top: Dict[str, List[str]] = {}
+        self.tracked = 0
+        self.pending_views: Dict[str, int] = defaultdict(int)
+        self.flush_needed = asyncio.Event()
+
+    def record(self, item_id: str, category: str, kind: str):
+        if category not in self.scores:
+            if len(self.scores) >= self.max_categories:
+                return
+            self.scores[category] = {}
+            self.top[category] = []
+        now = time.time()
+        exponent = self.decay * (now - self.landmark)
+        if exponent > 50:
+            self._rebase(now)
+            exponent = 0.0
+        scores = self.scores[category]
+        if item_id not in scores:
+            self.tracked += 1
+        scores[item_id] = scores.get(item_id, 0.0) + TRENDING_WEIGHTS[kind] * math.exp(exponent)
+        if kind == "view":
+            self.pending_views[item_id] += 1
+            if len(self.pending_views) >= self.max_pending_views:
+                self.flush_needed.set()
+        self._update_top(category, item_id)
+        if self.tracked > self.max_tracked:
+            self._prune()
+
+    def top_items(self, category: str, limit: int) -> List[str]:
+        return self.top.get(category, [])[:limit]
+
+    def remove(self, item_id: str):
+        for category in list(self.scores):
+            self._discard(category, item_id)
+        self.pending_views.pop(item_id, None)
+
+    def _discard(self, category: str, item_id: str):
+        scores = self.scores[category]
+        if scores.pop(item_id, None) is None:
+            return
+        self.tracked -= 1
+        if item_id in self.top[category]:
+            self.top[category].remove(item_id)
+        if not scores:
+            del self.scores[category]
+            del self.top[category]
+
+    def _update_top(self, category: str, item_id: str):
+        top = self.top[category]
+        scores = self.scores[category]
+        if item_id in top:
+            top.remove(item_id)
+        elif len(top) >= self.top_k and scores[item_id] <= scores[top[-1]]:
+            return
+        position = bisect.bisect_left([-scores[other] for other in top], -scores[item_id])
+        top.insert(position, item_id)
+        del top[self.top_k:]
+
+    def _rebase(self, now: float):
+        factor = math.exp(-self.decay * (now - self.landmark))
+        for scores in self.scores.values():
+            for item_id in scores:
+                scores[item_id] *= factor
+        self.landmark = now
+
+    def _prune(self):
+        candidates = [
+            (item_id in self.top[category], score, category, item_id)
+            for category, scores in self.scores.items()
+            for item_id, score in scores.items()
+        ]
+        excess = self.tracked - int(self.max_tracked * 0.9)
+        for _, _, category, item_id in heapq.nsmallest(excess, candidates):
+            self._discard(category, item_id)
+
+    async def flush_views(self):
+        self.flush_needed.clear()
+        if not self.pending_views:
+            return
+        batch, self.pending_views = self.pending_views, defaultdict(int)
+        try:
+            await mongo(lambda: db.items.bulk_write(
+                [UpdateOne({"id": item_id}, {"$inc": {"view_count": count}}) for item_id, count in batch.items()],
+                ordered=False
+            ), background=True)
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS as e:
+            for item_id, count in batch.items():
+                self.pending_views[item_id] += count
+            logger.warning(f"No se pudieron guardar las vistas, se reintentará: {e!r}")
+
+trending = TrendingTracker(TRENDING_HALF_LIFE_SECONDS, TRENDING_TOP_K, TRENDING_MAX_TRACKED)
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '30'))
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in SUPPORTED_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+def compress_body(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6)
+
+class CachedPayload:
+    # Serialized response body plus its compressed variants, so identical
+    # responses are encoded once per encoding instead of once per request.
+    # The first variant uses the middleware's fast level on the loop; for
+    # shared payloads (best=True) the best-level variant is built in a worker
+    # thread and replaces it when done, so the loop never runs brotli 11.
+    # Per-request payloads pass best=False and stay at the fast level.
+    def __init__(self, body: bytes, headers: Optional[Dict[str, str]] = None, best: bool = True):
+        self.body = body
+        self.headers = headers or {}
+        self.best = best
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.created = time.monotonic()
+        self.variants: Dict[str, bytes] = {}
+        self.upgrading: Set[str] = set()
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.created > CATALOG_CACHE_TTL
+
+    def encoded(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        if encoding is None or len(self.body) < COMPRESSION_MIN_SIZE:
+            return self.body, None
+        if encoding not in self.variants:
+            self.variants[encoding] = compress_body(self.body, encoding)
+        if self.best and encoding not in self.upgrading:
+            self.upgrading.add(encoding)
+            asyncio.get_running_loop().run_in_executor(None, self._compress_best, encoding)
+        return self.variants[encoding], encoding
+
+    def _compress_best(self, encoding: str):
+        self.variants[encoding] = compress_body(self.body, encoding, best=True)
+
+def payload_response(payload: CachedPayload, request: Request, stale: bool = False) -> Response:
+    headers = {**payload.headers, "ETag": payload.etag, "Vary": "Accept-Encoding"}
+    if stale:
+        headers["Warning"] = '110 - "Response is Stale"'
+        headers["X-Cache-Status"] = "stale"
+    if request.headers.get("if-none-match") == payload.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body, encoding = payload.encoded(negotiate_encoding(request.headers.get("accept-encoding", "")))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+        chunks: List[bytes] = []
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    "content-encoding" in headers
+                    or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            if len(body) >= self.minimum_size:
+                body = compress_body(body, encoding)
+                headers = MutableHeaders(raw=list(start_message["headers"]))
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                start_message["headers"] = headers.raw
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+catalog_adapter = TypeAdapter(List[GameHero])
+comments_adapter = TypeAdapter(List[Comment])
+catalog_cache: Dict[str, CachedPayload] = {}
+catalog_generation = 0
+item_ids_cache: Dict[str, Tuple[float, FrozenSet[str]]] = {}
+trending_cache: Dict[Tuple[str, int], Tuple[Tuple[str, ...], CachedPayload]] = {}
+
+def invalidate_catalog():
+    global catalog_generation
+    catalog_generation += 1
+    catalog_cache.clear()
+    item_ids_cache.clear()
+    trending_cache.clear()
+    if snapshot_publisher is not None:
+        snapshot_publisher.request()
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+SNAPSHOT_PAGE_SIZE = int(os.environ.get('SNAPSHOT_PAGE_SIZE', '50'))
+SNAPSHOT_KEEP_VERSIONS = int(os.environ.get('SNAPSHOT_KEEP_VERSIONS', '3'))
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get('SNAPSHOT_DEBOUNCE_SECONDS', '1'))
+SNAPSHOT_CATEGORY_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+# Upper bound on one publish; the lease is released as soon as it finishes.
+SNAPSHOT_LEASE_SECONDS = float(os.environ.get('SNAPSHOT_LEASE_SECONDS', '120'))
+
+def write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class SnapshotPublisher:
+    # Renders the catalog into immutable versioned directories
+    # (<version>/items/<category>.json and .../page-<n>.json, plus .gz/.br
+    # variants) and then atomically swaps manifest.json to point at the new
+    # version, so a static file server can answer catalog reads on its own.
+    # Every worker runs one, so publishing takes the "snapshot_publish" job
+    # lease, and a manifest generated from a later scan is never replaced.
+    def __init__(self, directory: Path, page_size: int, keep_versions: int):
+        self.directory = Path(directory)
+        self.page_size = page_size
+        self.keep_versions = keep_versions
+        self.pending = asyncio.Event()
+        self.current_version: Optional[str] = None
+        self.owner = uuid.uuid4().hex
+
+    def request(self):
+        self.pending.set()
+
+    async def run(self):
+        while True:
+            await self.pending.wait()
+            await asyncio.sleep(SNAPSHOT_DEBOUNCE_SECONDS)
+            self.pending.clear()
+            try:
+                if not await self.publish():
+                    # Another worker is publishing and may have scanned
+                    # before this worker's write, so try again afterwards.
+                    self.pending.set()
+            except (CircuitOpenError,) + MONGO_FAILURE_ERRORS as e:
+                logger.warning(f"Publicación del catálogo pospuesta: {e!r}")
+                self.pending.set()
+                await asyncio.sleep(background_breaker.reset_timeout)
+
+    async def publish(self) -> bool:
+        # Returns False when another worker holds the publish lease.
+        if not await acquire_job_lease("snapshot_publish", SNAPSHOT_LEASE_SECONDS, owner=self.owner):
+            return False
+        try:
+            await self._publish()
+        finally:
+            await release_job_lease("snapshot_publish", self.owner)
+        return True
+
+    async def _publish(self):
+        generated_at = datetime.now(timezone.utc)
+        items = await mongo(lambda: db.items.find({}, {"_id": 0}).sort(
+            [("created_at", 1), ("id", 1)]
+        ).max_time_ms(MONGO_BACKGROUND_DEADLINE_MS).to_list(None), background=True)
+        by_category: Dict[str, List[dict]] = defaultdict(list)
+        for item in items:
+            if not SNAPSHOT_CATEGORY_RE.match(item['category']):
+                logger.warning(f"Categoría omitida en la publicación: {item['category']!r}")
+                continue
+            if isinstance(item['created_at'], str):
+                item['created_at'] = datetime.fromisoformat(item['created_at'])
+            by_category[item['category']].append(item)
+
+        files: Dict[str, bytes] = {}
+        categories = {}
+        for category, category_items in sorted(by_category.items()):
+            files[f"items/{category}.json"] = catalog_adapter.dump_json(catalog_adapter.validate_python(category_items))
+            pages = max(math.ceil(len(category_items) / self.page_size), 1)
+            for page in range(pages):
+                chunk = category_items[page * self.page_size:(page + 1) * self.page_size]
+                files[f"items/{category}/page-{page + 1}.json"] = catalog_adapter.dump_json(catalog_adapter.validate_python(chunk))
+            categories[category] = {
+                "path": f"items/{category}.json",
+                "page_path": f"items/{category}/page-{{page}}.json",
+                "pages": pages,
+                "count": len(category_items),
+            }
+
+        digest = hashlib.sha256()
+        for path, body in sorted(files.items()):
+            digest.update(path.encode('utf-8'))
+            digest.update(body)
+        version = digest.hexdigest()[:16]
+        published = await run_in_threadpool(self._read_manifest)
+        if published is not None and published.get("version") == version:
+            self.current_version = version
+            return
+        manifest = {
+            "version": version,
+            "base": f"{version}/",
+            "generated_at": generated_at.isoformat(),
+            "page_size": self.page_size,
+            "encodings": list(SUPPORTED_ENCODINGS),
+            "categories": categories,
+        }
+        if not await run_in_threadpool(self._write, version, files, manifest):
+            logger.warning(f"Versión {version} descartada: ya hay un catálogo publicado más reciente")
+            return
+        self.current_version = version
+        logger.info(f"Catálogo publicado: versión {version}")
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            return json.loads((self.directory / "manifest.json").read_bytes())
+        except (OSError, ValueError):
+            return None
+
+    def _superseded(self, manifest: dict) -> bool:
+        # generated_at is taken before the scan, so a later value means the
+        # published manifest reflects writes this scan may have missed.
+        published = self._read_manifest()
+        if published is None:
+            return False
+        try:
+            return datetime.fromisoformat(published["generated_at"]) > datetime.fromisoformat(manifest["generated_at"])
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def _write(self, version: str, files: Dict[str, bytes], manifest: dict) -> bool:
+        if self._superseded(manifest):
+            return False
+        version_dir = self.directory / version
+        for path, body in files.items():
+            target = version_dir / path
+            write_atomic(target, body)
+            if len(body) >= COMPRESSION_MIN_SIZE:
+                for encoding in SUPPORTED_ENCODINGS:
+                    extension = "br" if encoding == "br" else "gz"
+                    write_atomic(target.with_name(f"{target.name}.{extension}"), compress_body(body, encoding, best=True))
+        if self._superseded(manifest):
+            return False
+        write_atomic(self.directory / "manifest.json", json.dumps(manifest).encode('utf-8'))
+        versions = sorted(
+            (path for path in self.directory.iterdir() if path.is_dir() and path.name != version),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+        for old in versions[self.keep_versions - 1:]:
+            shutil.rmtree(old, ignore_errors=True)
+        return True
+
+snapshot_publisher = (
+    SnapshotPublisher(Path(SNAPSHOT_DIR), SNAPSHOT_PAGE_SIZE, SNAPSHOT_KEEP_VERSIONS) if SNAPSHOT_DIR else None
+)
+
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', '10'))
+
+class SingleFlight:
+    # Concurrent callers with the same key share one in-flight call and its
+    # result or exception. The shared call is bounded by the timeout and is
+    # shielded so one caller disconnecting does not cancel it for the rest.
+    def __init__(self, timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self.calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(asyncio.wait_for(fn(), self.timeout))
+            self.calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(call)
+
+    def _forget(self, key: Hashable, call: asyncio.Future):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        if not call.cancelled():
+            call.exception()
+
+read_flight = SingleFlight()
+
+class LastGoodStore:
+    # Bounded LRU of the last successful payload per read, served while the
+    # Mongo circuit is open or a read fails.
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, CachedPayload]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CachedPayload]:
+        payload = self.entries.get(key)
+        if payload is not None:
+            self.entries.move_to_end(key)
+        return payload
+
+    def put(self, key: Hashable, payload: CachedPayload):
+        self.entries[key] = payload
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+last_good = LastGoodStore(int(os.environ.get('LAST_GOOD_MAX_ENTRIES', '2048')))
+
+async def read_with_fallback(
+    key: Hashable,
+    load: Callable[[], Awaitable[CachedPayload]],
+    flight_key: Optional[Hashable] = None
+) -> Tuple[CachedPayload, bool]:
+    try:
+        payload = await read_flight.do(flight_key or key, load)
+    except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+        payload = last_good.get(key)
+        if payload is None:
+            raise
+        metrics.inc("stale_responses_total", route=key[0])
+        return payload, True
+    last_good.put(key, payload)
+    return payload, False
+
+THUMBNAIL_SIZES = {"sm": 320, "md": 640}
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+THUMBNAIL_CACHE_DIR = Path(os.environ.get('THUMBNAIL_CACHE_DIR', ROOT_DIR / 'thumbnail_cache'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get('THUMBNAIL_MAX_SOURCE_BYTES', str(10 * 1024 * 1024)))
+
+class ImageFetchError(Exception):
+    pass
+
+class HttpImageFetcher:
+    def __init__(self, max_bytes: int = THUMBNAIL_MAX_SOURCE_BYTES, timeout: float = 10):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+    async def fetch(self, url: str) -> bytes:
+        return await run_in_threadpool(self._fetch, url)
+
+    def _fetch(self, url: str) -> bytes:
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ImageFetchError("Esquema de URL de imagen no soportado")
+        try:
+            with requests.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > self.max_bytes:
+                        raise ImageFetchError("La imagen original es demasiado grande")
+                return bytes(data)
+        except requests.RequestException as e:
+            raise ImageFetchError(f"No se pudo descargar la imagen: {e}")
+
+class LocalImageFetcher:
+    # Resolves the path component of image URLs under a local directory,
+    # used to run thumbnails without network access.
+    def __init__(self, root: Path, max_bytes: int = THUMBNAIL_MAX_SOURCE_BYTES):
+        self.root = Path(root).resolve()
+        self.max_bytes = max_bytes
+
+    async def fetch(self, url: str) -> bytes:
+        path = (self.root / urlparse(url).path.lstrip('/')).resolve()
+        if not path.is_relative_to(self.root) or not path.is_file():
+            raise ImageFetchError("Imagen no encontrada")
+        if path.stat().st_size > self.max_bytes:
+            raise ImageFetchError("La imagen original es demasiado grande")
+        return await run_in_threadpool(path.read_bytes)
+
+class ThumbnailCache:
+    # On-disk cache addressed by the digest of (source URL, size, format),
+    # evicted least-recently-used once it grows past max_bytes. Methods run
+    # in worker threads: the LRU bookkeeping is guarded by a lock and the
+    # file I/O happens outside it.
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = sorted(
+            (path for path in self.directory.glob("*/*") if not path.name.endswith(".tmp")),
+            key=lambda path: path.stat().st_atime
+        )
+        with self.lock:
+            for path in files:
+                size = path.stat().st_size
+                self.entries[path.name] = size
+                self.total_bytes += size
+        self.evict()
+
+    def path_for(self, digest: str) -> Path:
+        return self.directory / digest[:2] / digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self.lock:
+            if digest not in self.entries:
+                return None
+        try:
+            data = self.path_for(digest).read_bytes()
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(digest, 0)
+            return None
+        with self.lock:
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+        return data
+
+    def put(self, digest: str, data: bytes):
+        path = self.path_for(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.pop(digest, 0)
+            self.entries[digest] = len(data)
+        self.evict()
+
+    def evict(self):
+        evicted = []
+        with self.lock:
+            while self.total_bytes > self.max_bytes and self.entries:
+                digest, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                evicted.append(digest)
+        for digest in evicted:
+            try:
+                self.path_for(digest).unlink()
+            except FileNotFoundError:
+                pass
+
+def render_thumbnail(source: bytes, size: int, image_format: str) -> bytes:
+    try:
+        with Image.open(io.BytesIO(source)) as image:
+            image.draft("RGB", (size, size))
+            image = image.convert("RGB")
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            image.save(output, format=THUMBNAIL_FORMATS[image_format][0], quality=80)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageFetchError(f"Imagen no válida: {e}")
+    return output.getvalue()
+
+class ThumbnailService:
+    def __init__(self, fetcher, cache: ThumbnailCache):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.flight = SingleFlight(timeout=30)
+
+    async def get(self, image_url: str, size: str, image_format: str) -> Tuple[bytes, str]:
+        digest = hashlib.sha256(f"{image_url}|{size}|{image_format}".encode('utf-8')).hexdigest()
+        data = await run_in_threadpool(self.cache.get, digest)
+        if data is not None:
+            return data, digest
+        data = await self.flight.do(
+            digest, lambda: self._generate(digest, image_url, size, image_format)
+        )
+        return data, digest
+
+    async def _generate(self, digest: str, image_url: str, size: str, image_format: str) -> bytes:
+        source = await self.fetcher.fetch(image_url)
+        data = await run_in_threadpool(render_thumbnail, source, THUMBNAIL_SIZES[size], image_format)
+        await run_in_threadpool(self.cache.put, digest, data)
+        return data
+
+thumbnail_service = ThumbnailService(
+    fetcher=LocalImageFetcher(os.environ['THUMBNAIL_SOURCE_DIR']) if os.environ.get('THUMBNAIL_SOURCE_DIR') else HttpImageFetcher(),
+    cache=ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', '50'))
+PROFILE_MAX_ACTIVE = int(os.environ.get('PROFILE_MAX_ACTIVE', '4'))
+PROFILE_ROLE_CACHE_SECONDS = float(os.environ.get('PROFILE_ROLE_CACHE_SECONDS', '60'))
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def coroutine_frames(coro) -> Tuple[list, object]:
+    frames = []
+    awaited = coro
+    while awaited is not None:
+        frame = getattr(awaited, "cr_frame", None) or getattr(awaited, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaited = getattr(awaited, "cr_await", None) or getattr(awaited, "gi_yieldfrom", None)
+    return frames, awaited
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = datetime.now(timezone.utc)
+        self.duration_ms: Optional[float] = None
+        self.samples: Counter = Counter()
+
+    def summary(self) -> ProfileSummary:
+        return ProfileSummary(
+            id=self.id,
+            method=self.method,
+            path=self.path,
+            started_at=self.started_at,
+            duration_ms=self.duration_ms,
+            samples=sum(self.samples.values())
+        )
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in list(self.samples.items()))
+
+class Profiler:
+    # Statistical sampler for individual requests. One shared thread samples
+    # every active request task each PROFILE_INTERVAL: the live thread stack
+    # while the task is running on the loop, its awaited coroutine chain
+    # while it is suspended (e.g. waiting on Mongo). At most max_active
+    # requests are profiled at once; the thread exits when none are left.
+    # Stacks are kept in the folded format understood by flamegraph.pl and
+    # speedscope.
+    def __init__(self, interval: float, buffer_size: int, max_active: int):
+        self.interval = interval
+        self.max_active = max_active
+        self.sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+        self.profiles: "deque[RequestProfile]" = deque(maxlen=buffer_size)
+        self.active: Dict[str, Tuple[asyncio.Task, asyncio.AbstractEventLoop, int, RequestProfile]] = {}
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        return next((profile for profile in self.profiles if profile.id == profile_id), None)
+
+    def start(self, profile: RequestProfile, task: asyncio.Task, loop, thread_id: int) -> bool:
+        with self.lock:
+            if len(self.active) >= self.max_active:
+                return False
+            self.active[profile.id] = (task, loop, thread_id, profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+                self.thread.start()
+        return True
+
+    def finish(self, profile: RequestProfile):
+        with self.lock:
+            self.active.pop(profile.id, None)
+        self.profiles.append(profile)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                active = list(self.active.values())
+            thread_frames = sys._current_frames()
+            for task, loop, thread_id, profile in active:
+                self.sample(task, loop, thread_frames.get(thread_id), profile)
+
+    def sample(self, task: asyncio.Task, loop, thread_frame, profile: RequestProfile):
+        frames, awaited = coroutine_frames(task.get_coro())
+        if not frames:
+            return
+        if asyncio.current_task(loop) is task:
+            physical = []
+            frame = thread_frame
+            while frame is not None:
+                physical.append(frame)
+                frame = frame.f_back
+            physical.reverse()
+            root = next((i for i, f in enumerate(physical) if f is frames[0]), 0)
+            stack = [frame_label(f) for f in physical[root:]]
+        else:
+            stack = [frame_label(f) for f in frames]
+            if awaited is not None:
+                stack.append(f"[await {type(awaited).__name__}]")
+        profile.samples[";".join(stack)] += 1
+
+profiler = Profiler(PROFILE_INTERVAL, PROFILE_BUFFER_SIZE, PROFILE_MAX_ACTIVE)
+
+admin_role_cache: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+
+async def is_admin_request(headers: Headers) -> bool:
+    # Tokens carry the role at issue time, so non-admins are turned away
+    # without a lookup; an admin claim is confirmed against the users
+    # collection at most once per PROFILE_ROLE_CACHE_SECONDS. Any database
+    # error just leaves the request unprofiled.
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return False
+    user_id = claims.get("sub")
+    if claims.get("role") != "admin" or not user_id:
+        return False
+    cached = admin_role_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < PROFILE_ROLE_CACHE_SECONDS:
+        return cached[1]
+    try:
+        user = await mongo(lambda: db.users.find_one({"id": user_id}, {"_id": 0, "role": 1}))
+    except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+        return False
+    is_admin = bool(user) and user.get("role") == "admin"
+    admin_role_cache[user_id] = (time.monotonic(), is_admin)
+    admin_role_cache.move_to_end(user_id)
+    while len(admin_role_cache) > 1000:
+        admin_role_cache.popitem(last=False)
+    return is_admin
+
+class ProfilingMiddleware:
+    # Profiles a request when an admin sends the X-Profile header, or at
+    # random with probability profiler.sample_rate. Otherwise it only checks
+    # the sample rate and the raw header list.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = any(name == PROFILE_HEADER.encode() for name, _ in scope["headers"])
+        if not requested and not profiler.sample_rate:
+            await self.app(scope, receive, send)
+            return
+        if requested:
+            enabled = await is_admin_request(Headers(scope=scope))
+        else:
+            enabled = random.random() < profiler.sample_rate
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        if not profiler.start(profile, asyncio.current_task(), asyncio.get_running_loop(), threading.get_ident()):
+            metrics.inc("profiles_skipped_total")
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            profiler.finish(profile)
+
+# (tokens per second, burst) per route and identity
+RATE_LIMITS = {
+    "login": {"ip": (20 / 60, 20), "email": (5 / 60, 5)},
+    "register": {"ip": (5 / 60, 5), "email": (2 / 60, 2)},
+    "comment": {"ip": (60 / 60, 30), "user": (10 / 60, 10)},
+    "view": {"ip": (120 / 60, 60)},
+}
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Number of reverse proxies in front of the app that append to
+# X-Forwarded-For. RATE_LIMIT_TRUST_FORWARDED=true is kept as one hop.
+RATE_LIMIT_FORWARDED_HOPS = int(os.environ.get(
+    'RATE_LIMIT_FORWARDED_HOPS',
+    '1' if os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true' else '0'
+))
+
+class InMemoryRateLimitBackend:
+    # Token buckets for a single worker. A bucket that has refilled to its
+    # burst is indistinguishable from a missing one, so the periodic sweep
+    # drops every bucket whose refill time has passed.
+    def __init__(self, sweep_interval: float = 60):
+        self.sweep_interval = sweep_interval
+        self.buckets: Dict[str, Tuple[float, float, float]] = {}
+        self.next_sweep = time.monotonic() + sweep_interval
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.buckets = {k: bucket for k, bucket in self.buckets.items() if bucket[2] > now}
+            self.next_sweep = now + self.sweep_interval
+        bucket = self.buckets.get(key)
+        tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        if tokens < cost:
+            return (cost - tokens) / rate
+        tokens -= cost
+        self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return 0.0
+
+class MongoRateLimitBackend:
+    # Shared buckets for multi-worker deployments: one atomic pipeline
+    # update per check, with a TTL index removing buckets once refilled.
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        now = time.time()
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, rate]}
+        ]}]}
+        bucket = await mongo(lambda: self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": datetime.fromtimestamp(now + burst / rate, timezone.utc),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ), write=True)
+        return 0.0 if bucket["allowed"] else (cost - bucket["tokens"]) / rate
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def check(self, route: str, identity: str, value: str):
+        rate, burst = RATE_LIMITS[route][identity]
+        try:
+            retry_after = await self.backend.take(f"{route}:{identity}:{value}", rate, burst)
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+            return
+        if retry_after > 0:
+            metrics.inc("rate_limited_total", route=route, identity=identity)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Demasiadas solicitudes, inténtalo más tarde",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+rate_limiter = RateLimiter(
+    MongoRateLimitBackend(db.rate_limits) if RATE_LIMIT_BACKEND == 'mongo' else InMemoryRateLimitBackend()
+)
+
+def client_ip(request: Request) -> str:
+    # Proxies append the address they saw, so only the last
+    # RATE_LIMIT_FORWARDED_HOPS entries are trustworthy; anything to their
+    # left was sent by the client.
+    if RATE_LIMIT_FORWARDED_HOPS > 0:
+        entries = [entry.strip() for entry in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if entry.strip()]
+        if entries:
+            return entries[max(len(entries) - RATE_LIMIT_FORWARDED_HOPS, 0)]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limits(route: str, request: Request, user_id: Optional[str]):
+    # A request is charged once even when IdempotencyMiddleware has already
+    # checked it before the route dependency runs.
+    if request.scope.get("rate_limit_checked"):
+        return
+    request.scope["rate_limit_checked"] = True
+    await rate_limiter.check(route, "ip", client_ip(request))
+    if "user" in RATE_LIMITS[route] and user_id:
+        await rate_limiter.check(route, "user", user_id)
+
+def rate_limited(route: str):
+    # Route-level dependency: FastAPI runs it before the handler's own
+    # dependencies, so throttled requests never reach get_current_user,
+    # Mongo or bcrypt. The user id comes from the token without a lookup.
+    async def check_rate_limit(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+        user_id = None
+        if credentials is not None:
+            try:
+                user_id = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            except jwt.InvalidTokenError:
+                pass
+        await enforce_rate_limits(route, request, user_id)
+    return Depends(check_rate_limit)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+# Idempotent routes and the RATE_LIMITS entry checked before a key is claimed.
+IDEMPOTENT_ROUTES = {("POST", "/api/comments"): "comment", ("POST", "/api/items"): None}
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+
+class IdempotencyConflict(Exception):
+    pass
+
+class IdempotencyMismatch(Exception):
+    pass
+
+class IdempotencyStore:
+    # Completed responses live in a TTL-indexed collection with an LRU in
+    # front. A key is claimed by inserting an in_progress record; duplicates
+    # in this worker wait on the claimant's future, duplicates in other
+    # workers poll the record until it completes or its lock expires.
+    def __init__(self, collection, ttl: float, lock_seconds: float, cache_size: int):
+        self.collection = collection
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+    async def setup(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _remember(self, key: str, record: dict):
+        self.cache[key] = record
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _cached(self, key: str) -> Optional[dict]:
+        record = self.cache.get(key)
+        if record is None:
+            return None
+        if record['expires_at'] <= datetime.now(timezone.utc):
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return record
+
+    async def begin(self, key: str, fingerprint: str) -> Optional[dict]:
+        # Returns the stored record to replay, or None once this request
+        # owns the key and must call complete() or abort().
+        deadline = time.monotonic() + self.lock_seconds
+        while True:
+            record = self._cached(key)
+            if record is not None:
+                break
+            pending = self.in_flight.get(key)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            now = datetime.now(timezone.utc)
+            try:
+                await mongo(lambda: self.collection.insert_one({
+                    "_id": key,
+                    "fingerprint": fingerprint,
+                    "state": "in_progress",
+                    "locked_until": now + timedelta(seconds=self.lock_seconds),
+                    "expires_at": now + timedelta(seconds=self.ttl),
+                }), write=True)
+            except DuplicateKeyError:
+                record = await mongo(lambda: self.collection.find_one({"_id": key}))
+                if record is None:
+                    continue
+                if record['state'] == "completed":
+                    record['expires_at'] = record['expires_at'].replace(tzinfo=timezone.utc)
+                    self._remember(key, record)
+                    break
+                taken = await mongo(lambda: self.collection.find_one_and_update(
+                    {"_id": key, "state": "in_progress", "locked_until": {"$lt": now}},
+                    {"$set": {
+                        "fingerprint": fingerprint,
+                        "locked_until": now + timedelta(seconds=self.lock_seconds),
+                    }}
+                ), write=True)
+                if taken is None:
+                    if time.monotonic() > deadline:
+                        raise IdempotencyConflict(key)
+                    await asyncio.sleep(0.1)
+                    continue
+            self.in_flight[key] = asyncio.get_running_loop().create_future()
+            return None
+        if record['fingerprint'] != fingerprint:
+            raise IdempotencyMismatch(key)
+        return record
+
+    async def complete(self, key: str, status_code: int, content_type: str, body: bytes):
+        record = {
+            "fingerprint": None,
+            "state": "completed",
+            "status": status_code,
+            "content_type": content_type,
+            "body": body,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+        }
+        try:
+            stored = await mongo(lambda: self.collection.find_one_and_update(
+                {"_id": key},
+                {"$set": {k: v for k, v in record.items() if k != "fingerprint"}},
+                return_document=ReturnDocument.AFTER
+            ), write=True)
+            if stored is not None:
+                record['fingerprint'] = stored['fingerprint']
+                self._remember(key, record)
+        finally:
+            self._release(key)
+
+    async def abort(self, key: str):
+        try:
+            await mongo(lambda: self.collection.delete_one({"_id": key, "state": "in_progress"}), write=True)
+        finally:
+            self._release(key)
+
+    def _release(self, key: str):
+        pending = self.in_flight.pop(key, None)
+        if pending is not None and not pending.done():
+            pending.set_result(None)
+
+idempotency_store = IdempotencyStore(
+    db.idempotency_keys, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS, IDEMPOTENCY_CACHE_SIZE
+)
+
+class IdempotencyMiddleware:
+    # Handles Idempotency-Key on the routes in IDEMPOTENT_ROUTES before
+    # FastAPI runs validation or the insert. Keys are scoped to the token's
+    # user and bound to a hash of the request body; only 2xx responses are
+    # stored, so failed attempts can be retried. Requests without a valid
+    # token and throttled requests are never claimed, so they cost no writes.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idempotency_key) > 255:
+            await JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"detail": "Clave de idempotencia inválida"}
+            )(scope, receive, send)
+            return
+
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        try:
+            owner = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub") if scheme.lower() == "bearer" else None
+        except jwt.InvalidTokenError:
+            owner = None
+        if not owner:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        limited_route = IDEMPOTENT_ROUTES[(scope["method"], scope["path"])]
+        if limited_route is not None:
+            try:
+                await enforce_rate_limits(limited_route, Request(scope), owner)
+            except HTTPException as exc:
+                await JSONResponse(
+                    status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers
+                )(scope, replay_receive, send)
+                return
+
+        key = hashlib.sha256(f"{owner}|{scope['method']}|{scope['path']}|{idempotency_key}".encode('utf-8')).hexdigest()
+
+        try:
+            stored = await idempotency_store.begin(key, hashlib.sha256(body).hexdigest())
+        except IdempotencyMismatch:
+            await JSONResponse(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                content={"detail": "La clave de idempotencia ya se usó con otra solicitud"}
+            )(scope, replay_receive, send)
+            return
+        except IdempotencyConflict:
+            await JSONResponse(
+                status_code=status.HTTP_409_CONFLICT,
+                content={"detail": "La solicitud con esta clave de idempotencia sigue en curso"}
+            )(scope, replay_receive, send)
+            return
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+            await JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"detail": "Base de datos no disponible temporalmente"}
+            )(scope, replay_receive, send)
+            return
+        if stored is not None:
+            metrics.inc("idempotent_replays_total", route=scope["path"])
+            await Response(
+                content=stored['body'],
+                status_code=stored['status'],
+                media_type=stored['content_type'],
+                headers={"Idempotent-Replayed": "true"}
+            )(scope, replay_receive, send)
+            return
+
+        response_status = 500
+        response_headers = []
+        response_body = []
+
+        async def capture_send(message):
+            nonlocal response_status, response_headers
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                response_headers = message["headers"]
+            elif message["type"] == "http.response.body":
+                response_body.append(message.get("body", b""))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if 200 <= response_status < 300:
+                content_type = Headers(raw=response_headers).get("content-type", "application/json")
+                await idempotency_store.complete(key, response_status, content_type, b"".join(response_body))
+                completed = True
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+            logger.warning(f"No se pudo guardar la respuesta idempotente {key}")
+            completed = True
+        finally:
+            if not completed:
+                await idempotency_store.abort(key)
+
+def sign_optime(value: str) -> str:
+    return hmac.new(SECRET_KEY.encode('utf-8'), value.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def format_optime(optime: Timestamp) -> str:
+    value = f"{optime.time}.{optime.inc}"
+    return f"{value}.{sign_optime(value)}"
+
+def parse_optime(value: str) -> Optional[Timestamp]:
+    optime, _, signature = value.rpartition('.')
+    if not optime or not hmac.compare_digest(signature.encode('utf-8'), sign_optime(optime).encode('utf-8')):
+        return None
+    seconds, _, increment = optime.partition('.')
+    try:
+        parsed = Timestamp(int(seconds), int(increment))
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if parsed.time < time.time() - MONGO_MAX_STALENESS_SECONDS:
+        return None
+    return parsed
+
+@asynccontextmanager
+async def write_session(response: Response):
+    if not READ_ROUTING_ENABLED:
+        yield None
+        return
+    async with await client.start_session(causal_consistency=True) as session:
+        yield session
+        if session.operation_time is not None:
+            response.headers[READ_AFTER_HEADER] = format_optime(session.operation_time)
+
+@asynccontextmanager
+async def read_session(request: Request):
+    optime = parse_optime(request.headers.get(READ_AFTER_HEADER, "")) if READ_ROUTING_ENABLED else None
+    if optime is None:
+        yield None
+        return
+    async with await client.start_session(causal_consistency=True) as session:
+        session.advance_operation_time(optime)
+        yield session
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -116,7 +1610,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token inválido"
             )
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await mongo(lambda: db.users.find_one({"id": user_id}, {"_id": 0}))
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -130,15 +1624,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token expirado"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No se pudo validar el token"
         )
 
-@api_router.post("/auth/register", response_model=Token)
-async def register(user_data: UserCreate):
-    existing = await db.users.find_one({"email": user_data.email}, {"_id": 0})
+@api_router.post("/auth/register", response_model=Token, dependencies=[rate_limited("register")])
+async def register(user_data: UserCreate, response: Response):
+    await rate_limiter.check("register", "email", user_data.email.lower())
+    existing = await mongo(lambda: db.users.find_one({"email": user_data.email}, {"_id": 0}))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -156,18 +1651,20 @@ async def register(user_data: UserCreate):
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     user_dict['password'] = hashed_password.decode('utf-8')
     
-    await db.users.insert_one(user_dict)
+    async with write_session(response) as session:
+        await mongo(lambda: db.users.insert_one(user_dict, session=session), write=True)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data={"sub": user.id, "role": user.role}, expires_delta=access_token_expires
     )
     
     return Token(access_token=access_token, token_type="bearer", user=user)
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, dependencies=[rate_limited("login")])
 async def login(login_data: UserLogin):
-    user_doc = await db.users.find_one({"email": login_data.email}, {"_id": 0})
+    await rate_limiter.check("login", "email", login_data.email.lower())
+    user_doc = await mongo(lambda: db.users.find_one({"email": login_data.email}, {"_id": 0}))
     if not user_doc:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -187,7 +1684,7 @@ async def login(login_data: UserLogin):
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data={"sub": user.id, "role": user.role}, expires_delta=access_token_expires
     )
     
     return Token(access_token=access_token, token_type="bearer", user=user)
@@ -196,16 +1693,191 @@ async def login(login_data: UserLogin):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+async def load_catalog(category: str, session=None) -> CachedPayload:
+    generation = catalog_generation
+    items = await mongo(lambda: read_db.items.find(
+        {"category": category},
+        {"_id": 0},
+        session=session
+    ).max_time_ms(MONGO_READ_DEADLINE_MS).to_list(1000))
+    for item in items:
+        if isinstance(item['created_at'], str):
+            item['created_at'] = datetime.fromisoformat(item['created_at'])
+    payload = CachedPayload(catalog_adapter.dump_json(catalog_adapter.validate_python(items)))
+    if generation == catalog_generation:
+        catalog_cache[category] = payload
+    return payload
+
 @api_router.get("/items", response_model=List[GameHero])
-async def get_items(category: str):
-    items = await db.items.find({"category": category}, {"_id": 0}).to_list(1000)
+async def get_items(category: str, request: Request):
+    async with read_session(request) as session:
+        if session is not None:
+            try:
+                return payload_response(await load_catalog(category, session), request)
+            except (OperationFailure, CircuitOpenError) + MONGO_FAILURE_ERRORS as e:
+                logger.warning(f"Lectura causal fallida, se sirve el catálogo en caché: {e!r}")
+    payload = catalog_cache.get(category)
+    stale = False
+    if payload is None or payload.expired():
+        payload, stale = await read_with_fallback(
+            ("items", category),
+            lambda: load_catalog(category),
+            flight_key=("items", category, catalog_generation)
+        )
+    return payload_response(payload, request, stale=stale)
+
+async def run_search(q: str, category: str, page: int, limit: int) -> CachedPayload:
+    skip = (page - 1) * limit
+    total_exact = True
+    if search_index.enabled:
+        items, total = search_index.search(q, category, skip, limit)
+    else:
+        text_filter = {"category": category, "$text": {"$search": q}}
+        try:
+            items = await mongo(lambda: read_db.items.find(
+                text_filter,
+                {"_id": 0, "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).skip(skip).limit(limit).max_time_ms(MONGO_READ_DEADLINE_MS).to_list(limit))
+            count_limit = max(SEARCH_COUNT_LIMIT, skip + limit)
+            total = await mongo(lambda: read_db.items.count_documents(
+                text_filter, limit=count_limit + 1, maxTimeMS=MONGO_READ_DEADLINE_MS
+            ))
+            total_exact = total <= count_limit
+            total = min(total, count_limit)
+        except OperationFailure as e:
+            if e.code != 27:
+                raise
+            logger.warning(f"Búsqueda de texto no disponible, usando índice en memoria: {e}")
+            if not search_index.enabled:
+                await build_search_index()
+            items, total = search_index.search(q, category, skip, limit)
+    for item in items:
+        item.pop('score', None)
+        if isinstance(item['created_at'], str):
+            item['created_at'] = datetime.fromisoformat(item['created_at'])
+    results = SearchResults(items=items, total=total, total_exact=total_exact, page=page, limit=limit)
+    return CachedPayload(results.model_dump_json().encode('utf-8'), best=False)
+
+@api_router.get("/items/search", response_model=SearchResults)
+async def search_items(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    category: str = Query(...),
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100)
+):
+    payload = await read_flight.do(
+        ("search", q, category, page, limit), lambda: run_search(q, category, page, limit)
+    )
+    return payload_response(payload, request)
+
+async def load_trending(category: str, limit: int, item_ids: List[str]) -> CachedPayload:
+    generation = catalog_generation
+    items = []
+    if item_ids:
+        items = await mongo(lambda: read_db.items.find(
+            {"id": {"$in": item_ids}, "category": category},
+            {"_id": 0}
+        ).max_time_ms(MONGO_READ_DEADLINE_MS).to_list(len(item_ids)))
+    rank = {item_id: position for position, item_id in enumerate(item_ids)}
+    items.sort(key=lambda item: rank[item['id']])
     for item in items:
         if isinstance(item['created_at'], str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
-    return items
+    payload = CachedPayload(catalog_adapter.dump_json(catalog_adapter.validate_python(items)))
+    if generation == catalog_generation:
+        trending_cache[(category, limit)] = (tuple(item_ids), payload)
+    return payload
+
+@api_router.get("/items/trending", response_model=List[GameHero])
+async def get_trending(
+    category: str,
+    request: Request,
+    limit: int = Query(10, ge=1, le=TRENDING_TOP_K)
+):
+    item_ids = trending.top_items(category, limit)
+    cached = trending_cache.get((category, limit))
+    if cached is not None and cached[0] == tuple(item_ids) and not cached[1].expired():
+        return payload_response(cached[1], request)
+    payload, stale = await read_with_fallback(
+        ("trending", category, limit),
+        lambda: load_trending(category, limit, item_ids),
+        flight_key=("trending", category, limit, tuple(item_ids), catalog_generation)
+    )
+    return payload_response(payload, request, stale=stale)
+
+async def known_item_ids(category: str) -> FrozenSet[str]:
+    # Ids per category, cached like the catalog, so views for made-up ids
+    # are rejected without a lookup per request.
+    cached = item_ids_cache.get(category)
+    if cached is not None and time.monotonic() - cached[0] <= CATALOG_CACHE_TTL:
+        return cached[1]
+    generation = catalog_generation
+
+    async def load() -> FrozenSet[str]:
+        return frozenset(await mongo(lambda: read_db.items.distinct("id", {"category": category})))
+
+    try:
+        ids = await read_flight.do(("item_ids", category), load)
+    except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+        if cached is None:
+            raise
+        return cached[1]
+    if generation == catalog_generation:
+        item_ids_cache[category] = (time.monotonic(), ids)
+    return ids
+
+@api_router.post("/items/{item_id}/view", status_code=status.HTTP_202_ACCEPTED, dependencies=[rate_limited("view")])
+async def record_view(item_id: str, category: str):
+    if category not in ITEM_CATEGORIES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Categoría no válida"
+        )
+    if item_id not in await known_item_ids(category):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Item no encontrado"
+        )
+    trending.record(item_id, category, "view")
+    return {"message": "Vista registrada"}
+
+@api_router.get("/items/{item_id}/thumbnail")
+async def get_item_thumbnail(
+    item_id: str,
+    request: Request,
+    size: str = Query("md", pattern="^(sm|md)$"),
+    format: str = Query("webp", pattern="^(webp|jpeg)$")
+):
+    if Image is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Miniaturas no disponibles"
+        )
+    item = await mongo(lambda: read_db.items.find_one({"id": item_id}, {"_id": 0, "image_url": 1}))
+    if not item:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Item no encontrado"
+        )
+    try:
+        data, digest = await thumbnail_service.get(item['image_url'], size, format)
+    except ImageFetchError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=str(e)
+        )
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "public, max-age=86400"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=data, media_type=THUMBNAIL_FORMATS[format][1], headers=headers)
 
 @api_router.post("/items", response_model=GameHero)
-async def create_item(item_data: GameHeroCreate, current_user: User = Depends(get_current_user)):
+async def create_item(
+    item_data: GameHeroCreate,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -214,13 +1886,17 @@ async def create_item(item_data: GameHeroCreate, current_user: User = Depends(ge
     item = GameHero(**item_data.model_dump())
     item_dict = item.model_dump()
     item_dict['created_at'] = item_dict['created_at'].isoformat()
-    await db.items.insert_one(item_dict)
+    async with write_session(response) as session:
+        await mongo(lambda: db.items.insert_one(item_dict, session=session), write=True)
+    search_index.add(item_dict)
+    invalidate_catalog()
     return item
 
 @api_router.put("/items/{item_id}", response_model=GameHero)
 async def update_item(
     item_id: str,
     item_data: GameHeroUpdate,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     if current_user.role != "admin":
@@ -229,7 +1905,7 @@ async def update_item(
             detail="Solo los administradores pueden editar items"
         )
     
-    existing_item = await db.items.find_one({"id": item_id}, {"_id": 0})
+    existing_item = await mongo(lambda: db.items.find_one({"id": item_id}, {"_id": 0}))
     if not existing_item:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -237,48 +1913,140 @@ async def update_item(
         )
     
     update_data = {k: v for k, v in item_data.model_dump().items() if v is not None}
-    if update_data:
-        await db.items.update_one({"id": item_id}, {"$set": update_data})
-    
-    updated_item = await db.items.find_one({"id": item_id}, {"_id": 0})
+    async with write_session(response) as session:
+        if update_data:
+            await mongo(
+                lambda: db.items.update_one({"id": item_id}, {"$set": update_data}, session=session),
+                write=True
+            )
+        updated_item = await mongo(lambda: db.items.find_one({"id": item_id}, {"_id": 0}, session=session))
+    search_index.add(updated_item)
+    invalidate_catalog()
     if isinstance(updated_item['created_at'], str):
         updated_item['created_at'] = datetime.fromisoformat(updated_item['created_at'])
     
     return GameHero(**updated_item)
 
 @api_router.delete("/items/{item_id}")
-async def delete_item(item_id: str, current_user: User = Depends(get_current_user)):
+async def delete_item(
+    item_id: str,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Solo los administradores pueden eliminar items"
         )
     
-    result = await db.items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Item no encontrado"
-        )
-    
-    await db.comments.delete_many({"item_id": item_id})
+    async with write_session(response) as session:
+        result = await mongo(lambda: db.items.delete_one({"id": item_id}, session=session), write=True)
+        if result.deleted_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Item no encontrado"
+            )
+        
+        search_index.remove(item_id)
+        trending.remove(item_id)
+        invalidate_catalog()
+        await mongo(lambda: db.comments.delete_many({"item_id": item_id}, session=session), write=True)
+        await mongo(lambda: db.comments_archive.delete_many({"item_id": item_id}, session=session), write=True)
     
     return {"message": "Item eliminado exitosamente"}
 
-@api_router.get("/comments", response_model=List[Comment])
-async def get_comments(item_id: str, category: str):
-    comments = await db.comments.find(
-        {"item_id": item_id, "category": category},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(1000)
-    for comment in comments:
+COMMENTS_SORT = [("created_at", -1), ("id", -1)]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_comment_cursor(tier: str, comment: dict) -> str:
+    raw = json.dumps([tier, comment['created_at'], comment['id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_comment_cursor(cursor: str) -> Tuple[str, str, str]:
+    try:
+        tier, created_at, comment_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if tier not in ("hot", "archive") or not isinstance(created_at, str) or not isinstance(comment_id, str):
+            raise ValueError(tier)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor inválido"
+        )
+    return tier, created_at, comment_id
+
+def comments_after(item_id: str, category: str, created_at: Optional[str], comment_id: Optional[str]) -> dict:
+    query = {"item_id": item_id, "category": category}
+    if created_at is not None:
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": comment_id}},
+        ]
+    return query
+
+async def load_comments(
+    item_id: str,
+    category: str,
+    limit: int,
+    cursor: Optional[str],
+    session=None
+) -> CachedPayload:
+    # Newest comments live in `comments`; older ones are moved to
+    # `comments_archive` by archive_comments(). Archived comments are always
+    # older than the hot ones of the same item, so a page that exhausts the
+    # hot tier continues in the archive with the same keyset.
+    tier, created_at, comment_id = decode_comment_cursor(cursor) if cursor else ("hot", None, None)
+    comments = []
+    if tier == "hot":
+        comments = await mongo(lambda: read_db.comments.find(
+            comments_after(item_id, category, created_at, comment_id),
+            {"_id": 0},
+            session=session
+        ).sort(COMMENTS_SORT).limit(limit + 1).max_time_ms(MONGO_READ_DEADLINE_MS).to_list(limit + 1))
+    if len(comments) <= limit:
+        tier = "archive"
+        if comments:
+            created_at, comment_id = comments[-1]['created_at'], comments[-1]['id']
+        remaining = limit + 1 - len(comments)
+        archived = await mongo(lambda: read_db.comments_archive.find(
+            comments_after(item_id, category, created_at, comment_id),
+            {"_id": 0},
+            session=session
+        ).sort(COMMENTS_SORT).limit(remaining).max_time_ms(MONGO_READ_DEADLINE_MS).to_list(remaining))
+        seen = {comment['id'] for comment in comments}
+        comments += [comment for comment in archived if comment['id'] not in seen]
+    page = comments[:limit]
+    headers = {}
+    if len(comments) > limit:
+        headers[NEXT_CURSOR_HEADER] = encode_comment_cursor(tier, page[-1])
+    for comment in page:
         if isinstance(comment['created_at'], str):
             comment['created_at'] = datetime.fromisoformat(comment['created_at'])
-    return comments
+    return CachedPayload(comments_adapter.dump_json(comments_adapter.validate_python(page)), headers=headers, best=False)
+
+@api_router.get("/comments", response_model=List[Comment])
+async def get_comments(
+    item_id: str,
+    category: str,
+    request: Request,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    async with read_session(request) as session:
+        if session is not None:
+            try:
+                return payload_response(await load_comments(item_id, category, limit, cursor, session), request)
+            except (OperationFailure, CircuitOpenError) + MONGO_FAILURE_ERRORS as e:
+                logger.warning(f"Lectura causal fallida, se sirven los comentarios en caché: {e!r}")
+    payload, stale = await read_with_fallback(
+        ("comments", item_id, category, limit, cursor),
+        lambda: load_comments(item_id, category, limit, cursor)
+    )
+    return payload_response(payload, request, stale=stale)
 
-@api_router.post("/comments", response_model=Comment)
+@api_router.post("/comments", response_model=Comment, dependencies=[rate_limited("comment")])
 async def create_comment(
     comment_data: CommentCreate,
+    response: Response,
     current_user: User = Depends(get_current_user)
 ):
     comment = Comment(
@@ -288,24 +2056,164 @@ async def create_comment(
     )
     comment_dict = comment.model_dump()
     comment_dict['created_at'] = comment_dict['created_at'].isoformat()
-    await db.comments.insert_one(comment_dict)
+    async with write_session(response) as session:
+        await mongo(lambda: db.comments.insert_one(comment_dict, session=session), write=True)
+    # Category and item id come from the client; only real items may feed
+    # trending, or junk categories could fill TrendingTracker.max_categories.
+    if comment.category in ITEM_CATEGORIES:
+        try:
+            known = comment.item_id in await known_item_ids(comment.category)
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS:
+            known = False
+        if known:
+            trending.record(comment.item_id, comment.category, "comment")
     return comment
 
+@api_router.put("/admin/profiling", response_model=ProfilingSettings)
+async def update_profiling(settings: ProfilingSettings, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los administradores pueden configurar el perfilado"
+        )
+    profiler.sample_rate = settings.sample_rate
+    return settings
+
+@api_router.get("/admin/profiles", response_model=List[ProfileSummary])
+async def list_profiles(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los administradores pueden ver los perfiles"
+        )
+    return [profile.summary() for profile in reversed(profiler.profiles)]
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo los administradores pueden ver los perfiles"
+        )
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Perfil no encontrado"
+        )
+    return PlainTextResponse(profile.folded())
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(api_router)
 
+@app.exception_handler(CircuitOpenError)
+@app.exception_handler(ConnectionFailure)
+async def database_unavailable_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Base de datos no disponible temporalmente"},
+        headers={"Retry-After": str(int(mongo_breaker.reset_timeout))}
+    )
+
+@app.exception_handler(asyncio.TimeoutError)
+@app.exception_handler(ExecutionTimeout)
+async def timeout_exception_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content={"detail": "Tiempo de espera agotado"}
+    )
+
+app.add_middleware(IdempotencyMiddleware)
+
+app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[READ_AFTER_HEADER, NEXT_CURSOR_HEADER, "Idempotent-Replayed"],
 )
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', '0.1'))
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the event loop: when the writer thread falls behind and
+    # the queue is full, records are counted and dropped.
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+def configure_logging() -> QueueListener:
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers = [DroppingQueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(f"{__name__}.access")
+
+class AccessLogMiddleware:
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        elapsed_mongo = [0.0]
+        token = mongo_time.set(elapsed_mongo)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            mongo_time.reset(token)
+            if scope["method"] != "GET" or status_code >= 400 or random.random() < self.sample_rate:
+                route = scope.get("route")
+                access_logger.info("request", extra={"fields": {
+                    "method": scope["method"],
+                    "route": getattr(route, "path", scope["path"]),
+                    "status": status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "mongo_ms": round(elapsed_mongo[0] * 1000, 2),
+                }})
+
+app.add_middleware(AccessLogMiddleware)
 
 @app.on_event("startup")
 async def create_admin_user():
@@ -323,6 +2231,188 @@ async def create_admin_user():
         await db.users.insert_one(admin_dict)
         logger.info("Usuario administrador creado: admin@supergamer.com / admin")
 
+SEARCH_INDEX_REFRESH_SECONDS = float(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', '60'))
+search_index_flight = SingleFlight(timeout=MONGO_BACKGROUND_DEADLINE_MS / 1000)
+
+async def load_search_index():
+    # A fresh index is built and swapped in whole, so searches never see a
+    # half-built one. The scan is repeated if this worker changed the catalog
+    # meanwhile, so its own write is not lost until the next refresh.
+    global search_index
+    while True:
+        generation = catalog_generation
+        items = await mongo(lambda: db.items.find({}, {"_id": 0}).to_list(None), background=True)
+        if generation == catalog_generation:
+            break
+    index = SearchIndex()
+    index.enabled = True
+    for item in items:
+        index.add(item)
+    search_index = index
+    logger.info(f"Índice de búsqueda en memoria construido con {len(index.docs)} items")
+
+async def build_search_index():
+    await search_index_flight.do("search_index", load_search_index)
+
+async def refresh_search_index():
+    # Other workers' writes only reach this index through a rebuild.
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_SECONDS)
+        if not search_index.enabled:
+            continue
+        try:
+            await build_search_index()
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS as e:
+            logger.warning(f"No se pudo refrescar el índice de búsqueda: {e!r}")
+
+@app.on_event("startup")
+async def create_search_index():
+    if os.environ.get('SEARCH_BACKEND', 'mongo') == 'memory':
+        await build_search_index()
+        return
+    try:
+        await db.items.create_index(
+            [("category", 1)] + [(field, "text") for field in SEARCH_FIELD_WEIGHTS],
+            weights=SEARCH_FIELD_WEIGHTS,
+            default_language="none",
+            name="items_text_search"
+        )
+    except OperationFailure as e:
+        logger.warning(f"No se pudo crear el índice de texto, usando índice en memoria: {e}")
+        await build_search_index()
+
+@app.on_event("startup")
+async def start_search_index_refresh():
+    app.state.search_index_refresh = asyncio.create_task(refresh_search_index())
+
+@app.on_event("startup")
+async def load_thumbnail_cache():
+    await run_in_threadpool(thumbnail_service.cache.load)
+
+COMMENTS_ARCHIVE_AFTER_DAYS = float(os.environ.get('COMMENTS_ARCHIVE_AFTER_DAYS', '90'))
+COMMENTS_HOT_PER_ITEM = int(os.environ.get('COMMENTS_HOT_PER_ITEM', '200'))
+COMMENTS_ARCHIVE_BATCH = int(os.environ.get('COMMENTS_ARCHIVE_BATCH', '500'))
+COMMENTS_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('COMMENTS_ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+async def move_comments_to_archive(comments: List[dict]):
+    # Upsert before delete: a crash in between leaves a duplicate that the
+    # next run overwrites, never a lost comment.
+    await mongo(lambda: db.comments_archive.bulk_write(
+        [ReplaceOne({"id": comment['id']}, comment, upsert=True) for comment in comments],
+        ordered=False
+    ), background=True)
+    await mongo(lambda: db.comments.delete_many(
+        {"id": {"$in": [comment['id'] for comment in comments]}}
+    ), background=True)
+
+async def acquire_job_lease(name: str, seconds: float, owner: Optional[str] = None) -> bool:
+    # One worker per interval runs a periodic job: the upsert only matches an
+    # expired lease, and while another worker holds it the insert collides.
+    now = datetime.now(timezone.utc)
+    try:
+        await mongo(lambda: db.job_leases.update_one(
+            {"_id": name, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=seconds), "owner": owner}},
+            upsert=True
+        ), background=True)
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def release_job_lease(name: str, owner: str):
+    # Only the holder releases, so a lease that expired and was taken over
+    # by another worker is left alone.
+    await mongo(lambda: db.job_leases.delete_one({"_id": name, "owner": owner}), background=True)
+
+async def archive_comments() -> int:
+    moved = 0
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=COMMENTS_ARCHIVE_AFTER_DAYS)).isoformat()
+    while True:
+        batch = await mongo(lambda: db.comments.find(
+            {"created_at": {"$lt": cutoff}},
+            {"_id": 0}
+        ).sort("created_at", 1).limit(COMMENTS_ARCHIVE_BATCH).to_list(COMMENTS_ARCHIVE_BATCH), background=True)
+        if not batch:
+            break
+        await move_comments_to_archive(batch)
+        moved += len(batch)
+
+    # Per-item cap: walk the catalog (comments of deleted items are removed
+    # with them) and skip past the newest COMMENTS_HOT_PER_ITEM entries of the
+    # (item_id, category, created_at, id) index, instead of grouping the
+    # whole comments collection.
+    items = await mongo(lambda: db.items.find({}, {"_id": 0, "id": 1, "category": 1}).to_list(None), background=True)
+    for item in items:
+        while True:
+            batch = await mongo(lambda: db.comments.find(
+                {"item_id": item['id'], "category": item['category']},
+                {"_id": 0}
+            ).sort(COMMENTS_SORT).skip(COMMENTS_HOT_PER_ITEM).limit(COMMENTS_ARCHIVE_BATCH).to_list(COMMENTS_ARCHIVE_BATCH), background=True)
+            if not batch:
+                break
+            await move_comments_to_archive(batch)
+            moved += len(batch)
+    return moved
+
+async def run_comment_archival():
+    while True:
+        try:
+            if await acquire_job_lease("comment_archival", COMMENTS_ARCHIVE_INTERVAL_SECONDS):
+                moved = await archive_comments()
+                if moved:
+                    logger.info(f"Comentarios archivados: {moved}")
+        except (CircuitOpenError,) + MONGO_FAILURE_ERRORS as e:
+            logger.warning(f"Archivado de comentarios pospuesto: {e!r}")
+        await asyncio.sleep(COMMENTS_ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_comment_archival():
+    for collection in (db.comments, db.comments_archive):
+        await collection.create_index([("item_id", 1), ("category", 1), ("created_at", -1), ("id", -1)])
+    await db.comments.create_index([("created_at", 1)])
+    await db.comments_archive.create_index([("id", 1)], unique=True)
+    app.state.comment_archival = None
+    if COMMENTS_ARCHIVE_INTERVAL_SECONDS > 0:
+        app.state.comment_archival = asyncio.create_task(run_comment_archival())
+
+@app.on_event("startup")
+async def setup_idempotency_store():
+    await idempotency_store.setup()
+
+@app.on_event("startup")
+async def setup_rate_limiter():
+    if isinstance(rate_limiter.backend, MongoRateLimitBackend):
+        await rate_limiter.backend.setup()
+
+@app.on_event("startup")
+async def start_snapshot_publisher():
+    app.state.snapshot_publisher = None
+    if snapshot_publisher is not None:
+        snapshot_publisher.request()
+        app.state.snapshot_publisher = asyncio.create_task(snapshot_publisher.run())
+
+async def flush_trending_views():
+    while True:
+        try:
+            await asyncio.wait_for(trending.flush_needed.wait(), TRENDING_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        await trending.flush_views()
+
+@app.on_event("startup")
+async def start_trending_flush():
+    app.state.trending_flush = asyncio.create_task(flush_trending_views())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    app.state.trending_flush.cancel()
+    app.state.search_index_refresh.cancel()
+    for task in (app.state.comment_archival, app.state.snapshot_publisher):
+        if task is not None:
+            task.cancel()
+    await trending.flush_views()
+    client.close()
+
+@app.on_event("shutdown")
+async def stop_log_listener():
+    log_listener.stop()
\ No newline at end of file
@@ -3,6 +3,7 @@ import axios from 'axios';
 import { motion } from 'framer-motion';
 import { MessageCircle, Send } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
+import apiService from '../services/api';
 import { toast } from 'sonner';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -10,21 +11,23 @@ const API = `${BACKEND_URL}/api`;
 
 export const CommentSection = ({ itemId, category, variant = 'gaming' }) => {
   const [comments, setComments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [newComment, setNewComment] = useState('');
   const [loading, setLoading] = useState(false);
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const isGaming = variant === 'gaming';
 
   useEffect(() => {
     fetchComments();
   }, [itemId, category]);
 
-  const fetchComments = async () => {
+  const fetchComments = async (cursor = null) => {
     try {
       const response = await axios.get(`${API}/comments`, {
-        params: { item_id: itemId, category }
+        params: { item_id: itemId, category, ...(cursor && { cursor }) }
       });
-      setComments(response.data);
+      setComments(cursor ? (previous) => [...previous, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error al cargar comentarios:', error);
     }
@@ -36,12 +39,8 @@ export const CommentSection = ({ itemId, category, variant = 'gaming' }) => {
 
     setLoading(true);
     try {
-      const response = await axios.post(`${API}/comments`, {
-        item_id: itemId,
-        category,
-        text: newComment
-      });
-      setComments([response.data, ...comments]);
+      const comment = await apiService.createComment({ item_id: itemId, category, text: newComment }, token);
+      setComments([comment, ...comments]);
       setNewComment('');
       toast.success('Comentario publicado');
     } catch (error) {
@@ -158,6 +157,20 @@ export const CommentSection = ({ itemId, category, variant = 'gaming' }) => {
           ))
         )}
       </div>
+
+      {nextCursor && (
+        <button
+          onClick={() => fetchComments(nextCursor)}
+          data-testid="load-more-comments"
+          className={
+            isGaming
+              ? 'mt-6 w-full px-6 py-2 rounded-full font-bold bg-transparent border-2 border-cyan-400 text-cyan-400 hover:bg-cyan-400 hover:text-black transition-all duration-300'
+              : 'mt-6 w-full px-6 py-2 rounded-full font-bold bg-transparent border-2 border-black text-hero-text hover:bg-hero-surface transition-all'
+          }
+        >
+          Ver más comentarios
+        </button>
+      )}
     </div>
   );
 };
\ No newline at end of file
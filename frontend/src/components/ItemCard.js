@@ -28,6 +28,7 @@ export const ItemCard = ({ item, variant = 'gaming', onUpdate, onDelete }) => {
   const isGaming = variant === 'gaming';
   const { user } = useAuth();
   const isAdmin = user?.role === 'admin';
+  const [thumbnailFailed, setThumbnailFailed] = useState(false);
   const [editOpen, setEditOpen] = useState(false);
   const [deleteOpen, setDeleteOpen] = useState(false);
   const [editData, setEditData] = useState({
@@ -72,8 +73,10 @@ export const ItemCard = ({ item, variant = 'gaming', onUpdate, onDelete }) => {
     >
       <div className="relative h-48 overflow-hidden">
         <img
-          src={item.image_url}
+          src={BACKEND_URL && !thumbnailFailed ? `${API}/items/${item.id}/thumbnail` : item.image_url}
           alt={item.title}
+          loading="lazy"
+          onError={() => setThumbnailFailed(true)}
           className="w-full h-full object-cover"
         />
       </div>
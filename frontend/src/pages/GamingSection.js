@@ -1,5 +1,4 @@
 import React, { useState, useEffect } from 'react';
-import axios from 'axios';
 import { motion } from 'framer-motion';
 import { ArrowLeft, Plus, Gamepad2, Moon, Sun } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
@@ -7,6 +6,7 @@ import { ItemCard } from '../components/ItemCard';
 import { CommentSection } from '../components/CommentSection';
 import { useTheme } from '../contexts/ThemeContext';
 import { useAuth } from '../contexts/AuthContext';
+import apiService from '../services/api';
 import { toast } from 'sonner';
 import {
   Dialog,
@@ -16,9 +16,6 @@ import {
   DialogTrigger,
 } from '../components/ui/dialog';
 
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
-const API = `${BACKEND_URL}/api`;
-
 export const GamingSection = () => {
   const [items, setItems] = useState([]);
   const [selectedItem, setSelectedItem] = useState(null);
@@ -31,7 +28,7 @@ export const GamingSection = () => {
   });
   const navigate = useNavigate();
   const { theme, toggleTheme } = useTheme();
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const isAdmin = user?.role === 'admin';
 
   useEffect(() => {
@@ -42,22 +39,21 @@ export const GamingSection = () => {
 
   const fetchItems = async () => {
     try {
-      const response = await axios.get(`${API}/items`, {
-        params: { category: 'games' }
-      });
-      setItems(response.data);
+      setItems(await apiService.getItems('games'));
     } catch (error) {
       console.error('Error al cargar items:', error);
     }
   };
 
+  const handleSelectItem = (item) => {
+    setSelectedItem(item);
+    apiService.recordView(item.id, 'games').catch(() => {});
+  };
+
   const handleCreateItem = async (e) => {
     e.preventDefault();
     try {
-      await axios.post(`${API}/items`, {
-        ...newItem,
-        category: 'games'
-      });
+      await apiService.createItem({ ...newItem, category: 'games' }, token);
       toast.success('Juego agregado');
       setDialogOpen(false);
       setNewItem({ title: '', description: '', image_url: '', official_link: '' });
@@ -199,7 +195,7 @@ export const GamingSection = () => {
         ) : (
           <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-8">
             {items.map((item) => (
-              <div key={item.id} onClick={() => setSelectedItem(item)} className="cursor-pointer">
+              <div key={item.id} onClick={() => handleSelectItem(item)} className="cursor-pointer">
                 <ItemCard 
                   item={item} 
                   variant="gaming"
@@ -5,11 +5,73 @@ import mockBackend from './mockBackend';
 const IS_GITHUB_PAGES = !process.env.REACT_APP_BACKEND_URL || process.env.REACT_APP_BACKEND_URL.includes('github.io');
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Catálogo publicado como archivos estáticos por el backend (SNAPSHOT_DIR)
+const SNAPSHOT_URL = process.env.REACT_APP_SNAPSHOT_URL;
+const MANIFEST_TTL_MS = 30000;
+
+// Tras una escritura el backend devuelve X-Read-After; reenviarlo en las
+// lecturas del mismo recurso (items, comments) garantiza ver los propios
+// cambios aunque lea una réplica secundaria. Pasado MONGO_MAX_STALENESS_SECONDS
+// todas las réplicas tienen la escritura, así que el token caduca y las
+// lecturas vuelven a la caché del backend.
+const READ_AFTER_TTL_MS = 90000;
+const readAfter = {};
+
+const apiResource = (url) => (url?.startsWith(API) ? url.slice(API.length).split(/[/?]/)[1] : null);
+
+axios.interceptors.response.use((response) => {
+  const value = response.headers['x-read-after'];
+  const resource = apiResource(response.config.url);
+  if (value && resource) readAfter[resource] = { value, expires: Date.now() + READ_AFTER_TTL_MS };
+  return response;
+});
+
+axios.interceptors.request.use((config) => {
+  const token = readAfter[apiResource(config.url)];
+  if (token && (config.method || 'get').toLowerCase() === 'get') {
+    if (token.expires > Date.now()) {
+      config.headers = { ...config.headers, 'X-Read-After': token.value };
+    } else {
+      delete readAfter[apiResource(config.url)];
+    }
+  }
+  return config;
+});
+
+// Las creaciones llevan una Idempotency-Key fija por envío: si la red falla
+// o el backend responde 503, el reintento no duplica el elemento/comentario
+const IDEMPOTENT_RETRIES = 2;
+
+async function postIdempotent(url, data, token) {
+  const headers = { Authorization: `Bearer ${token}`, 'Idempotency-Key': crypto.randomUUID() };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, data, { headers });
+    } catch (error) {
+      const retryable = !error.response || error.response.status === 503 || error.response.status === 409;
+      if (!retryable || attempt >= IDEMPOTENT_RETRIES) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+    }
+  }
+}
 
 // API Service que usa backend real o mock según el entorno
 class ApiService {
   constructor() {
     this.useMock = IS_GITHUB_PAGES;
+    this.manifest = null;
+    this.manifestFetchedAt = 0;
+    // Tras editar el catálogo, la publicación estática tarda en reflejarlo
+    this.catalogWrittenAt = 0;
+  }
+
+  async getSnapshotManifest() {
+    if (!this.manifest || Date.now() - this.manifestFetchedAt > MANIFEST_TTL_MS) {
+      const response = await axios.get(`${SNAPSHOT_URL}/manifest.json`);
+      this.manifest = response.data;
+      this.manifestFetchedAt = Date.now();
+    }
+    return this.manifest;
   }
 
   // Auth
@@ -44,21 +106,49 @@ class ApiService {
     if (this.useMock) {
       return await mockBackend.getItems(category);
     }
+    if (SNAPSHOT_URL && Date.now() - this.catalogWrittenAt > READ_AFTER_TTL_MS) {
+      try {
+        const manifest = await this.getSnapshotManifest();
+        const entry = manifest.categories[category];
+        if (!entry) return [];
+        const response = await axios.get(`${SNAPSHOT_URL}/${manifest.base}${entry.path}`);
+        return response.data;
+      } catch (error) {
+        console.error('Catálogo estático no disponible, usando la API:', error);
+      }
+    }
     const response = await axios.get(`${API}/items`, { params: { category } });
     return response.data;
   }
 
+  async searchItems(query, category, page = 1, limit = 20) {
+    if (this.useMock) {
+      return await mockBackend.searchItems(query, category, page, limit);
+    }
+    const response = await axios.get(`${API}/items/search`, {
+      params: { q: query, category, page, limit }
+    });
+    return response.data;
+  }
+
+  async recordView(itemId, category) {
+    if (this.useMock) {
+      return;
+    }
+    await axios.post(`${API}/items/${itemId}/view`, null, { params: { category } });
+  }
+
   async createItem(itemData, token) {
+    this.catalogWrittenAt = Date.now();
     if (this.useMock) {
       return await mockBackend.createItem(itemData, token);
     }
-    const response = await axios.post(`${API}/items`, itemData, {
-      headers: { Authorization: `Bearer ${token}` }
-    });
+    const response = await postIdempotent(`${API}/items`, itemData, token);
     return response.data;
   }
 
   async updateItem(itemId, updateData, token) {
+    this.catalogWrittenAt = Date.now();
     if (this.useMock) {
       return await mockBackend.updateItem(itemId, updateData, token);
     }
@@ -69,6 +159,7 @@ class ApiService {
   }
 
   async deleteItem(itemId, token) {
+    this.catalogWrittenAt = Date.now();
     if (this.useMock) {
       return await mockBackend.deleteItem(itemId, token);
     }
@@ -93,9 +184,7 @@ class ApiService {
     if (this.useMock) {
       return await mockBackend.createComment(commentData, token);
     }
-    const response = await axios.post(`${API}/comments`, commentData, {
-      headers: { Authorization: `Bearer ${token}` }
-    });
+    const response = await postIdempotent(`${API}/comments`, commentData, token);
     return response.data;
   }
 }
@@ -95,6 +95,30 @@ class MockBackendService {
     return items.filter(item => item.category === category);
   }
 
+  async searchItems(query, category, page = 1, limit = 20) {
+    const terms = query.toLowerCase().split(/\s+/).filter(Boolean);
+    const scored = (await this.getItems(category))
+      .map(item => {
+        const title = item.title.toLowerCase();
+        const description = item.description.toLowerCase();
+        const score = terms.reduce(
+          (acc, term) => acc + (title.includes(term) ? 3 : 0) + (description.includes(term) ? 1 : 0),
+          0
+        );
+        return { item, score };
+      })
+      .filter(({ score }) => score > 0)
+      .sort((a, b) => b.score - a.score);
+    const start = (page - 1) * limit;
+    return {
+      items: scored.slice(start, start + limit).map(({ item }) => item),
+      total: scored.length,
+      total_exact: true,
+      page,
+      limit
+    };
+  }
+
   async createItem(itemData, token) {
     const user = await this.getMe(token);
     if (user.role !== 'admin') {
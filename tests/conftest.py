@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'supergamer_test')
+os.environ.setdefault('THUMBNAIL_CACHE_DIR', tempfile.mkdtemp(prefix='supergamer-thumbnails-'))
+os.environ.setdefault('ACCESS_LOG_SAMPLE_RATE', '0')
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+ADMIN_CREDENTIALS = {"email": "admin@supergamer.com", "password": "admin"}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """The backend module on a fresh in-memory database with its per-process state reset."""
+    from mongomock_motor import AsyncMongoMockClient
+    import server as module
+
+    database = AsyncMongoMockClient()[os.environ['DB_NAME']]
+    monkeypatch.setattr(module, "db", database)
+    monkeypatch.setattr(module, "read_db", database)
+    monkeypatch.setattr(module, "mongo_breaker", module.CircuitBreaker("mongo", 5, 10))
+    monkeypatch.setattr(module, "background_breaker", module.CircuitBreaker("mongo_background", 5, 60))
+    monkeypatch.setattr(module, "read_flight", module.SingleFlight())
+    monkeypatch.setattr(module, "last_good", module.LastGoodStore(128))
+    monkeypatch.setattr(module, "search_index", module.SearchIndex())
+    monkeypatch.setattr(module, "search_index_flight", module.SingleFlight(timeout=30))
+    monkeypatch.setattr(module, "trending", module.TrendingTracker(3600, 10, 1000))
+    monkeypatch.setattr(module, "rate_limiter", module.RateLimiter(module.InMemoryRateLimitBackend()))
+    monkeypatch.setattr(
+        module,
+        "idempotency_store",
+        module.IdempotencyStore(database.idempotency_keys, 3600, 5, 100)
+    )
+    monkeypatch.setattr(module, "snapshot_publisher", None)
+    module.catalog_cache.clear()
+    module.item_ids_cache.clear()
+    module.trending_cache.clear()
+    module.admin_role_cache.clear()
+    asyncio.run(module.create_admin_user())
+    return module
+
+
+@pytest.fixture
+def client(server):
+    # No lifespan: the startup hooks start background loops and the
+    # shutdown hooks stop the process-wide log listener.
+    from fastapi.testclient import TestClient
+
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def admin_headers(client):
+    response = client.post('/api/auth/login', json=ADMIN_CREDENTIALS)
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def create_item(client, admin_headers):
+    def create(title="Zelda", description="Aventura", category="games", **extra):
+        response = client.post('/api/items', json={
+            "title": title,
+            "description": description,
+            "image_url": "https://example.com/image.png",
+            "official_link": "https://example.com",
+            "category": category,
+            **extra,
+        }, headers=admin_headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
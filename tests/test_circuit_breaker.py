@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+
+async def fail():
+    raise asyncio.TimeoutError()
+
+
+async def succeed():
+    return "ok"
+
+
+def open_breaker(breaker):
+    breaker.state = breaker.OPEN
+    breaker.opened_at = time.monotonic()
+
+
+def test_breaker_opens_after_threshold_and_rejects_without_calling(server):
+    breaker = server.CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    calls = []
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await breaker.call(fail)
+        assert breaker.state == breaker.OPEN
+
+        async def tracked():
+            calls.append(1)
+            return "ok"
+
+        with pytest.raises(server.CircuitOpenError):
+            await breaker.call(tracked)
+
+    asyncio.run(run())
+    assert calls == []
+
+
+def test_success_resets_the_failure_count(server):
+    breaker = server.CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(fail)
+        await breaker.call(succeed)
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(fail)
+
+    asyncio.run(run())
+    assert breaker.state == breaker.CLOSED
+
+
+def test_other_errors_do_not_count(server):
+    breaker = server.CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+
+    async def broken():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        asyncio.run(breaker.call(broken))
+    assert breaker.state == breaker.CLOSED
+
+
+def test_half_open_trial_closes_or_reopens(server):
+    breaker = server.CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(fail)
+        assert breaker.state == breaker.OPEN
+
+        await asyncio.sleep(0.02)
+        assert await breaker.call(succeed) == "ok"
+        assert breaker.state == breaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_half_open_allows_a_single_trial(server):
+    breaker = server.CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(breaker.call(slow), breaker.call(slow), return_exceptions=True)
+
+    trial, rejected = asyncio.run(run())
+    assert trial == "ok"
+    assert isinstance(rejected, server.CircuitOpenError)
+
+
+def test_mongo_applies_the_read_deadline(server, monkeypatch):
+    monkeypatch.setattr(server, "MONGO_READ_DEADLINE_MS", 10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(server.mongo(lambda: asyncio.sleep(1)))
+    assert server.mongo_breaker.failures == 1
+
+
+def test_background_calls_use_their_own_breaker(server):
+    open_breaker(server.background_breaker)
+
+    with pytest.raises(server.CircuitOpenError):
+        asyncio.run(server.mongo(succeed, background=True))
+    assert asyncio.run(server.mongo(succeed)) == "ok"
+    assert server.mongo_breaker.state == server.mongo_breaker.CLOSED
+
+
+def test_comments_are_served_stale_while_the_breaker_is_open(server, client, create_item):
+    item = create_item()
+    params = {"item_id": item["id"], "category": "games"}
+    fresh = client.get('/api/comments', params=params)
+    assert fresh.status_code == 200
+
+    open_breaker(server.mongo_breaker)
+    stale = client.get('/api/comments', params=params)
+
+    assert stale.status_code == 200
+    assert stale.headers["x-cache-status"] == "stale"
+    assert stale.json() == fresh.json()
+
+
+def test_reads_without_fallback_fail_fast_with_503(server, client):
+    open_breaker(server.mongo_breaker)
+
+    response = client.get('/api/comments', params={"item_id": "nuevo", "category": "games"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(int(server.mongo_breaker.reset_timeout))
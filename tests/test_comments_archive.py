@@ -0,0 +1,95 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+def make_comment(item_id, age, category="games"):
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": "u1",
+        "user_name": "Ana",
+        "item_id": item_id,
+        "category": category,
+        "text": f"hace {age}",
+        "created_at": (datetime.now(timezone.utc) - age).isoformat(),
+    }
+
+
+@pytest.fixture
+def seed(server):
+    def insert(*comments):
+        asyncio.run(server.db.comments.insert_many([dict(comment) for comment in comments]))
+        return comments
+    return insert
+
+
+def test_old_and_overflowing_comments_move_to_the_archive(server, seed, create_item, monkeypatch):
+    monkeypatch.setattr(server, "COMMENTS_HOT_PER_ITEM", 3)
+    item = create_item()
+    other = create_item(title="Otro", category="heroes")
+    recent = seed(*[make_comment(item["id"], timedelta(minutes=i)) for i in range(6)])
+    seed(make_comment(other["id"], timedelta(days=server.COMMENTS_ARCHIVE_AFTER_DAYS + 1), "heroes"))
+
+    moved = asyncio.run(server.archive_comments())
+
+    async def ids(collection):
+        return {comment["id"] for comment in await collection.find({}, {"id": 1}).to_list(None)}
+
+    assert moved == 4
+    assert asyncio.run(ids(server.db.comments)) == {comment["id"] for comment in recent[:3]}
+    assert len(asyncio.run(ids(server.db.comments_archive))) == 4
+
+
+def test_archival_does_not_group_the_whole_collection(server, seed, create_item, monkeypatch):
+    item = create_item()
+    seed(make_comment(item["id"], timedelta(minutes=1)))
+
+    def no_aggregate(*args, **kwargs):
+        raise AssertionError("archive_comments must not aggregate over comments")
+
+    monkeypatch.setattr(type(server.db.comments), "aggregate", no_aggregate, raising=False)
+
+    assert asyncio.run(server.archive_comments()) == 0
+
+
+def test_job_lease_is_exclusive_until_it_expires(server):
+    async def run():
+        first = await server.acquire_job_lease("archival", 60)
+        second = await server.acquire_job_lease("archival", 60)
+        await server.db.job_leases.update_one(
+            {"_id": "archival"}, {"$set": {"locked_until": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        third = await server.acquire_job_lease("archival", 60)
+        return first, second, third
+
+    assert asyncio.run(run()) == (True, False, True)
+
+
+def test_pages_fall_through_from_hot_to_archive(server, client, seed, create_item, monkeypatch):
+    monkeypatch.setattr(server, "COMMENTS_HOT_PER_ITEM", 3)
+    item = create_item()
+    comments = seed(*[make_comment(item["id"], timedelta(minutes=i)) for i in range(7)])
+    asyncio.run(server.archive_comments())
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"item_id": item["id"], "category": "games", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get('/api/comments', params=params)
+        assert response.status_code == 200
+        seen += [comment["id"] for comment in response.json()]
+        cursor = response.headers.get(server.NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+
+    assert seen == [comment["id"] for comment in comments]
+
+
+def test_invalid_cursor_is_rejected(client):
+    response = client.get('/api/comments', params={"item_id": "x", "category": "games", "cursor": "no-es-un-cursor"})
+
+    assert response.status_code == 400
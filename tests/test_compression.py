@@ -0,0 +1,64 @@
+import asyncio
+import gzip
+
+
+def test_negotiation_prefers_brotli_and_honours_q_zero(server):
+    assert server.negotiate_encoding("gzip, deflate") == "gzip"
+    assert server.negotiate_encoding("gzip;q=0, identity") is None
+    assert server.negotiate_encoding("") is None
+    if "br" in server.SUPPORTED_ENCODINGS:
+        assert server.negotiate_encoding("gzip, br") == "br"
+        assert server.negotiate_encoding("br;q=0, *") == "gzip"
+
+
+def test_catalog_is_compressed_and_revalidated_with_etag(client, create_item):
+    for i in range(20):
+        create_item(title=f"Juego {i}", description="Una descripción larga " * 5)
+
+    response = client.get('/api/items', params={"category": "games"}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 20
+
+    revalidated = client.get(
+        '/api/items',
+        params={"category": "games"},
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]}
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get('/api/items', params={"category": "games"}, headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_shared_payload_upgrades_to_best_level_off_the_loop(server, monkeypatch):
+    body = b'{"items": "' + b"catalogo " * 2000 + b'"}'
+    levels = []
+    original = server.compress_body
+
+    def recording_compress(data, encoding, best=False):
+        levels.append(best)
+        return original(data, encoding, best)
+
+    monkeypatch.setattr(server, "compress_body", recording_compress)
+
+    async def encode():
+        payload = server.CachedPayload(body)
+        first, _ = payload.encoded("gzip")
+        for _ in range(100):
+            if len(levels) == 2:
+                break
+            await asyncio.sleep(0.01)
+        return payload, first
+
+    payload, first = asyncio.run(encode())
+
+    assert levels == [False, True]
+    assert gzip.decompress(first) == body
+    assert gzip.decompress(payload.variants["gzip"]) == body
@@ -0,0 +1,154 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+
+def comment_body(text="Hola"):
+    return {"item_id": "zelda", "category": "games", "text": text}
+
+
+def count(collection, query=None):
+    return asyncio.run(collection.count_documents(query or {}))
+
+
+def test_repeated_key_replays_the_stored_response(server, client, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "clave-1"}
+
+    first = client.post('/api/comments', json=comment_body(), headers=headers)
+    second = client.post('/api/comments', json=comment_body(), headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert count(server.db.comments) == 1
+
+
+def test_replay_survives_losing_the_memory_cache(server, client, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "clave-1"}
+    first = client.post('/api/comments', json=comment_body(), headers=headers)
+    server.idempotency_store.cache.clear()
+
+    second = client.post('/api/comments', json=comment_body(), headers=headers)
+
+    assert second.json() == first.json()
+    assert count(server.db.comments) == 1
+
+
+def test_reusing_a_key_with_another_body_is_rejected(server, client, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "clave-1"}
+    client.post('/api/comments', json=comment_body("Hola"), headers=headers)
+
+    response = client.post('/api/comments', json=comment_body("Adiós"), headers=headers)
+
+    assert response.status_code == 422
+    assert count(server.db.comments) == 1
+
+
+def test_failed_attempts_are_not_stored(server, client, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "clave-1"}
+
+    invalid = client.post('/api/comments', json={"item_id": "zelda", "category": "games"}, headers=headers)
+    retried = client.post('/api/comments', json={"item_id": "zelda", "category": "games"}, headers=headers)
+    fixed = client.post('/api/comments', json=comment_body(), headers=headers)
+
+    assert invalid.status_code == retried.status_code == 422
+    assert fixed.status_code == 200
+    assert "idempotent-replayed" not in fixed.headers
+
+
+def test_keys_are_scoped_to_the_user(server, client, admin_headers):
+    registered = client.post('/api/auth/register', json={"email": "ana@example.com", "name": "Ana", "password": "secreta"})
+    ana_headers = {"Authorization": f"Bearer {registered.json()['access_token']}", "Idempotency-Key": "clave-1"}
+
+    admin = client.post('/api/comments', json=comment_body(), headers={**admin_headers, "Idempotency-Key": "clave-1"})
+    ana = client.post('/api/comments', json=comment_body(), headers=ana_headers)
+
+    assert ana.json()["id"] != admin.json()["id"]
+    assert ana.json()["user_name"] == "Ana"
+    assert count(server.db.comments) == 2
+
+
+def test_requests_without_a_key_are_not_deduplicated(server, client, admin_headers):
+    client.post('/api/comments', json=comment_body(), headers=admin_headers)
+    client.post('/api/comments', json=comment_body(), headers=admin_headers)
+
+    assert count(server.db.comments) == 2
+
+
+def test_requests_without_a_token_are_not_claimed(server, client, monkeypatch):
+    calls = []
+    original = server.mongo
+
+    async def counting(*args, **kwargs):
+        calls.append(1)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "mongo", counting)
+    response = client.post('/api/comments', json=comment_body(), headers={"Idempotency-Key": "clave-1"})
+
+    assert response.status_code in (401, 403)
+    assert calls == []
+    assert count(server.db.idempotency_keys) == 0
+
+
+def test_each_request_is_charged_to_the_rate_limit_once(server, client, admin_headers):
+    burst = server.RATE_LIMITS["comment"]["user"][1]
+    statuses = [
+        client.post('/api/comments', json=comment_body(), headers={**admin_headers, "Idempotency-Key": f"clave-{i}"}).status_code
+        for i in range(burst + 1)
+    ]
+
+    assert statuses == [200] * burst + [429]
+
+
+def test_concurrent_duplicates_wait_for_the_first_request(server, admin_headers):
+    headers = {**admin_headers, "Idempotency-Key": "clave-concurrente"}
+    item = {
+        "title": "Zelda", "description": "Aventura", "image_url": "https://example.com/a.png",
+        "official_link": "https://example.com", "category": "games"
+    }
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[client.post('/api/items', json=item, headers=headers) for _ in range(5)])
+
+    responses = asyncio.run(run())
+
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert count(server.db.items) == 1
+
+
+def claim_from_another_worker(server, key, locked_for):
+    now = datetime.now(timezone.utc)
+    asyncio.run(server.db.idempotency_keys.insert_one({
+        "_id": key,
+        "fingerprint": "huella",
+        "state": "in_progress",
+        "locked_until": now + timedelta(seconds=locked_for),
+        "expires_at": now + timedelta(hours=1),
+    }))
+
+
+def test_key_held_by_another_worker_conflicts_after_waiting(server):
+    store = server.IdempotencyStore(server.db.idempotency_keys, ttl=3600, lock_seconds=0.2, cache_size=10)
+    claim_from_another_worker(server, "clave", locked_for=60)
+
+    async def run():
+        try:
+            await store.begin("clave", "huella")
+        except server.IdempotencyConflict:
+            return "conflict"
+
+    assert asyncio.run(run()) == "conflict"
+
+
+def test_expired_claims_are_taken_over(server):
+    store = server.IdempotencyStore(server.db.idempotency_keys, ttl=3600, lock_seconds=5, cache_size=10)
+    claim_from_another_worker(server, "clave", locked_for=-1)
+
+    assert asyncio.run(store.begin("clave", "huella")) is None
+    assert "clave" in store.in_flight
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import queue
+
+import pytest
+
+ACCESS_LOGGER = "server.access"
+
+
+def dropped(server):
+    return server.metrics.counters[("log_records_dropped_total", ())]
+
+
+def make_record(message="hola", **fields):
+    record = logging.LogRecord("server", logging.INFO, __file__, 1, message, None, None)
+    if fields:
+        record.fields = fields
+    return record
+
+
+def access_entries(caplog):
+    return [record.fields for record in caplog.records if record.name == ACCESS_LOGGER]
+
+
+def test_full_queue_drops_and_counts_without_blocking(server):
+    handler = server.DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = dropped(server)
+
+    handler.handle(make_record("primero"))
+    handler.handle(make_record("segundo"))
+
+    assert handler.queue.qsize() == 1
+    assert handler.queue.get_nowait().getMessage() == "primero"
+    assert dropped(server) == before + 1
+
+
+def test_json_formatter_includes_the_extra_fields(server):
+    entry = json.loads(server.JsonFormatter().format(make_record("petición", route="/api/items", status=200)))
+
+    assert entry["message"] == "petición"
+    assert entry["level"] == "INFO"
+    assert (entry["route"], entry["status"]) == ("/api/items", 200)
+
+
+def test_access_log_uses_the_route_template_and_mongo_time(server, client, admin_headers, create_item, caplog):
+    item = create_item()
+    caplog.clear()
+
+    with caplog.at_level(logging.INFO, logger=ACCESS_LOGGER):
+        client.post(f'/api/items/{item["id"]}/view', params={"category": "games"})
+
+    [entry] = access_entries(caplog)
+    assert entry["method"] == "POST"
+    assert entry["route"] == "/api/items/{item_id}/view"
+    assert entry["status"] == 202
+    assert entry["duration_ms"] >= entry["mongo_ms"] > 0
+
+
+def respond(status_code):
+    async def app(scope, receive, send):
+        if status_code is None:
+            raise RuntimeError("fallo")
+        await send({"type": "http.response.start", "status": status_code, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def call(server, sample_rate, method, status_code):
+    async def run():
+        middleware = server.AccessLogMiddleware(respond(status_code), sample_rate=sample_rate)
+        scope = {"type": "http", "method": method, "path": "/api/prueba", "headers": []}
+
+        async def send(message):
+            pass
+
+        try:
+            await middleware(scope, None, send)
+        except RuntimeError:
+            pass
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("method,status_code,logged", [
+    ("GET", 200, False),
+    ("GET", 404, True),
+    ("GET", None, True),
+    ("POST", 200, True),
+    ("DELETE", 204, True),
+])
+def test_writes_and_errors_are_always_logged(server, caplog, method, status_code, logged):
+    with caplog.at_level(logging.INFO, logger=ACCESS_LOGGER):
+        call(server, 0.0, method, status_code)
+
+    entries = access_entries(caplog)
+    assert bool(entries) == logged
+    if status_code is None:
+        assert entries[0]["status"] == 500
+
+
+def test_successful_reads_are_sampled(server, caplog):
+    with caplog.at_level(logging.INFO, logger=ACCESS_LOGGER):
+        call(server, 1.0, "GET", 200)
+
+    assert access_entries(caplog)[0]["route"] == "/api/prueba"
@@ -0,0 +1,147 @@
+import asyncio
+import re
+import threading
+
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+from starlette.datastructures import Headers
+
+
+def bearer(server, **claims):
+    return Headers({"authorization": f"Bearer {server.create_access_token(claims)}"})
+
+
+def counting_mongo(server, monkeypatch, error=None):
+    calls = []
+    original = server.mongo
+
+    async def counting(*args, **kwargs):
+        calls.append(1)
+        if error is not None:
+            raise error
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "mongo", counting)
+    return calls
+
+
+def admin_id(server):
+    return asyncio.run(server.db.users.find_one({"role": "admin"}))["id"]
+
+
+def test_non_admin_tokens_skip_the_lookup(server, monkeypatch):
+    calls = counting_mongo(server, monkeypatch)
+
+    assert asyncio.run(server.is_admin_request(bearer(server, sub="u1", role="user"))) is False
+    assert asyncio.run(server.is_admin_request(Headers({"authorization": "Bearer basura"}))) is False
+    assert calls == []
+
+
+def test_admin_role_is_confirmed_once_then_cached(server, monkeypatch):
+    calls = counting_mongo(server, monkeypatch)
+    headers = bearer(server, sub=admin_id(server), role="admin")
+
+    assert asyncio.run(server.is_admin_request(headers)) is True
+    assert asyncio.run(server.is_admin_request(headers)) is True
+    assert calls == [1]
+
+
+def test_forged_admin_claim_is_rejected_by_the_lookup(server):
+    assert asyncio.run(server.is_admin_request(bearer(server, sub="desconocido", role="admin"))) is False
+
+
+def test_database_errors_leave_the_request_unprofiled(server, monkeypatch):
+    headers = bearer(server, sub=admin_id(server), role="admin")
+    counting_mongo(server, monkeypatch, error=ServerSelectionTimeoutError("sin servidor"))
+
+    assert asyncio.run(server.is_admin_request(headers)) is False
+
+
+def test_open_breaker_does_not_fail_profiled_requests(server, client):
+    headers = {**bearer(server, sub=admin_id(server), role="admin"), "X-Profile": "1"}
+    server.mongo_breaker._transition(server.CircuitBreaker.OPEN)
+
+    response = client.get('/api/metrics', headers=headers)
+
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def profiler(server, monkeypatch):
+    instance = server.Profiler(interval=0.001, buffer_size=3, max_active=2)
+    monkeypatch.setattr(server, "profiler", instance)
+    return instance
+
+
+@pytest.fixture
+def slow_mongo(server, monkeypatch):
+    original = server.mongo
+
+    async def slow(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "mongo", slow)
+
+
+def profiled_get(client, admin_headers):
+    return client.get('/api/items', params={"category": "games"}, headers={**admin_headers, "X-Profile": "1"})
+
+
+def test_profiled_request_returns_folded_stacks(server, client, admin_headers, profiler, slow_mongo):
+    response = profiled_get(client, admin_headers)
+    profile_id = response.headers["x-profile-id"]
+
+    [summary] = client.get('/api/admin/profiles', headers=admin_headers).json()
+    folded = client.get(f'/api/admin/profiles/{profile_id}', headers=admin_headers)
+
+    assert summary["id"] == profile_id and summary["path"] == "/api/items"
+    assert summary["samples"] > 0 and summary["duration_ms"] >= 50
+    lines = folded.text.splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == summary["samples"]
+    assert all(re.fullmatch(r"[^;]+(;[^;]+)* \d+", line) for line in lines)
+    assert any("get_items" in line for line in lines)
+    assert not profiler.active
+
+
+def test_profile_buffer_keeps_the_latest_profiles(server, client, admin_headers, profiler):
+    ids = [profiled_get(client, admin_headers).headers["x-profile-id"] for _ in range(5)]
+
+    listed = client.get('/api/admin/profiles', headers=admin_headers).json()
+
+    assert [profile["id"] for profile in listed] == ids[:1:-1]
+    assert client.get(f'/api/admin/profiles/{ids[0]}', headers=admin_headers).status_code == 404
+
+
+def test_concurrent_profiles_share_one_thread_and_are_capped(server, client, admin_headers, profiler):
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(asyncio.sleep(1))
+        held = [server.RequestProfile("GET", f"/ocupado/{i}") for i in range(2)]
+        assert profiler.start(held[0], task, loop, threading.get_ident())
+        sampler = profiler.thread
+        assert profiler.start(held[1], task, loop, threading.get_ident())
+        assert profiler.thread is sampler and sampler.is_alive()
+
+        response = profiled_get(client, admin_headers)
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+
+        for profile in held:
+            profiler.finish(profile)
+        task.cancel()
+        loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+    finally:
+        loop.close()
+    assert "x-profile-id" in profiled_get(client, admin_headers).headers
+
+
+def test_sample_rate_is_admin_only_and_bounded(server, client, admin_headers, profiler):
+    registered = client.post('/api/auth/register', json={"email": "ana@example.com", "name": "Ana", "password": "secreta"})
+    user_headers = {"Authorization": f"Bearer {registered.json()['access_token']}"}
+
+    assert client.put('/api/admin/profiling', json={"sample_rate": 1}, headers=user_headers).status_code == 403
+    assert client.put('/api/admin/profiling', json={"sample_rate": 1.5}, headers=admin_headers).status_code == 422
+    assert client.put('/api/admin/profiling', json={"sample_rate": 1}, headers=admin_headers).status_code == 200
+
+    assert "x-profile-id" in client.get('/api/items', params={"category": "games"}).headers
@@ -0,0 +1,127 @@
+import asyncio
+
+from starlette.requests import Request
+
+
+def request_from(*forwarded, peer="10.0.0.1"):
+    return Request({
+        "type": "http",
+        "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded],
+        "client": (peer, 1234),
+    })
+
+
+def test_bucket_allows_the_burst_then_refills(server):
+    backend = server.InMemoryRateLimitBackend()
+
+    async def run():
+        allowed = [await backend.take("k", rate=100, burst=2) for _ in range(2)]
+        retry_after = await backend.take("k", rate=100, burst=2)
+        await asyncio.sleep(0.02)
+        return allowed, retry_after, await backend.take("k", rate=100, burst=2)
+
+    allowed, retry_after, refilled = asyncio.run(run())
+
+    assert allowed == [0.0, 0.0]
+    assert 0 < retry_after <= 0.01
+    assert refilled == 0.0
+
+
+def test_buckets_are_independent_and_swept_once_full(server):
+    backend = server.InMemoryRateLimitBackend(sweep_interval=0)
+
+    async def run():
+        await backend.take("a", rate=1000, burst=1)
+        assert await backend.take("b", rate=1000, burst=1) == 0.0
+        await asyncio.sleep(0.01)
+        await backend.take("c", rate=1000, burst=1)
+
+    asyncio.run(run())
+    assert set(backend.buckets) == {"c"}
+
+
+def test_client_ip_ignores_forwarded_for_by_default(server, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_FORWARDED_HOPS", 0)
+
+    assert server.client_ip(request_from("1.1.1.1")) == "10.0.0.1"
+
+
+def test_client_ip_takes_the_entry_added_by_the_trusted_proxy(server, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_FORWARDED_HOPS", 1)
+    assert server.client_ip(request_from("spoofed, 203.0.113.7")) == "203.0.113.7"
+    assert server.client_ip(request_from("spoofed", "203.0.113.7")) == "203.0.113.7"
+    assert server.client_ip(request_from()) == "10.0.0.1"
+
+    monkeypatch.setattr(server, "RATE_LIMIT_FORWARDED_HOPS", 2)
+    assert server.client_ip(request_from("spoofed, 203.0.113.7, 198.51.100.1")) == "203.0.113.7"
+
+
+def test_login_is_throttled_per_email_with_retry_after(server, client):
+    credentials = {"email": "nadie@example.com", "password": "incorrecta"}
+    burst = server.RATE_LIMITS["login"]["email"][1]
+
+    statuses = [client.post('/api/auth/login', json=credentials).status_code for _ in range(burst)]
+    throttled = client.post('/api/auth/login', json={**credentials, "email": "NADIE@example.com"})
+
+    assert statuses == [401] * burst
+    assert throttled.status_code == 429
+    assert int(throttled.headers["retry-after"]) >= 1
+
+
+def test_rotating_forwarded_for_does_not_reset_the_ip_budget(server, client, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_FORWARDED_HOPS", 1)
+    burst = server.RATE_LIMITS["login"]["ip"][1]
+
+    statuses = [
+        client.post(
+            '/api/auth/login',
+            json={"email": f"usuario{i}@example.com", "password": "x"},
+            headers={"X-Forwarded-For": f"198.51.100.{i}, 203.0.113.7"}
+        ).status_code
+        for i in range(burst + 1)
+    ]
+
+    assert statuses[:burst] == [401] * burst
+    assert statuses[burst] == 429
+
+
+def test_throttled_requests_never_reach_mongo(server, client, admin_headers, monkeypatch):
+    burst = server.RATE_LIMITS["comment"]["user"][1]
+    comment = {"item_id": "x", "category": "games", "text": "hola"}
+    for _ in range(burst):
+        assert client.post('/api/comments', json=comment, headers=admin_headers).status_code == 200
+
+    calls = []
+    original = server.mongo
+
+    async def counting(*args, **kwargs):
+        calls.append(1)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "mongo", counting)
+    response = client.post('/api/comments', json=comment, headers=admin_headers)
+
+    assert response.status_code == 429
+    assert calls == []
+
+
+def test_throttled_idempotent_requests_never_reach_mongo(server, client, admin_headers, monkeypatch):
+    burst = server.RATE_LIMITS["comment"]["user"][1]
+    comment = {"item_id": "x", "category": "games", "text": "hola"}
+    for i in range(burst):
+        headers = {**admin_headers, "Idempotency-Key": f"clave-{i}"}
+        assert client.post('/api/comments', json=comment, headers=headers).status_code == 200
+
+    calls = []
+    original = server.mongo
+
+    async def counting(*args, **kwargs):
+        calls.append(1)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(server, "mongo", counting)
+    response = client.post('/api/comments', json=comment, headers={**admin_headers, "Idempotency-Key": "otra"})
+
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert calls == []
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+from bson import Timestamp
+from pymongo.errors import ExecutionTimeout
+from pymongo.read_preferences import Primary, ReadPreference
+
+REPLICA_SET_URL = os.environ.get('MONGO_REPLICA_SET_URL')
+
+
+class FakeSession:
+    def __init__(self, operation_time=None):
+        self.operation_time = operation_time
+        self.advanced_to = None
+
+    def advance_operation_time(self, optime):
+        self.advanced_to = optime
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeClient:
+    def __init__(self, session):
+        self.session = session
+
+    async def start_session(self, causal_consistency=False):
+        assert causal_consistency
+        return self.session
+
+
+def test_reads_default_to_the_primary():
+    import server
+
+    if os.environ.get('MONGO_READ_PREFERENCE', 'primary') != 'primary':
+        pytest.skip("MONGO_READ_PREFERENCE overridden in the environment")
+    assert server.READ_ROUTING_ENABLED is False
+    assert server.read_db.read_preference == Primary()
+
+
+def test_secondary_preferences_bound_staleness(server):
+    preference = server.READ_PREFERENCES["secondaryPreferred"]()
+
+    assert preference.mode == ReadPreference.SECONDARY_PREFERRED.mode
+    assert preference.max_staleness == server.MONGO_MAX_STALENESS_SECONDS
+
+
+def test_writes_omit_the_read_after_header_when_routing_is_off(client, create_item, admin_headers):
+    item = create_item()
+
+    response = client.post('/api/comments', json={
+        "item_id": item["id"], "category": "games", "text": "Hola"
+    }, headers=admin_headers)
+
+    assert response.status_code == 200
+    assert "x-read-after" not in response.headers
+
+
+def test_read_after_tokens_are_signed_and_expire(server):
+    now = int(time.time())
+    token = server.format_optime(Timestamp(now, 7))
+
+    assert server.parse_optime(token) == Timestamp(now, 7)
+    assert server.parse_optime(f"{now + 3600}.1") is None
+    assert server.parse_optime(token.replace(f"{now}.7", f"{now + 3600}.7")) is None
+    assert server.parse_optime(token[:-1] + ("0" if token[-1] != "0" else "1")) is None
+    assert server.parse_optime("ñ.ñ.ñ") is None
+    old = server.format_optime(Timestamp(now - server.MONGO_MAX_STALENESS_SECONDS - 10, 1))
+    assert server.parse_optime(old) is None
+
+
+def test_write_session_returns_the_signed_operation_time(server, monkeypatch):
+    from fastapi import Response
+
+    optime = Timestamp(int(time.time()), 3)
+    monkeypatch.setattr(server, "READ_ROUTING_ENABLED", True)
+    monkeypatch.setattr(server, "client", FakeClient(FakeSession(optime)))
+    response = Response()
+
+    async def write():
+        async with server.write_session(response) as session:
+            assert session is not None
+
+    asyncio.run(write())
+    assert server.parse_optime(response.headers[server.READ_AFTER_HEADER]) == optime
+
+
+def test_read_session_waits_only_for_valid_tokens(server, monkeypatch):
+    from starlette.requests import Request
+
+    session = FakeSession()
+    monkeypatch.setattr(server, "READ_ROUTING_ENABLED", True)
+    monkeypatch.setattr(server, "client", FakeClient(session))
+    optime = Timestamp(int(time.time()), 2)
+
+    def request(value):
+        return Request({"type": "http", "headers": [(b"x-read-after", value.encode())]})
+
+    async def open_session(value):
+        async with server.read_session(request(value)) as opened:
+            return opened
+
+    assert asyncio.run(open_session(f"{optime.time}.2")) is None
+    assert asyncio.run(open_session(server.format_optime(optime))) is session
+    assert session.advanced_to == optime
+
+
+def test_failed_causal_read_falls_back_to_the_shared_read(server, client, create_item, monkeypatch):
+    item = create_item()
+    original = server.load_comments
+
+    @asynccontextmanager
+    async def causal_session(request):
+        yield FakeSession() if request.headers.get(server.READ_AFTER_HEADER) else None
+
+    async def load_comments(item_id, category, limit, cursor, session=None):
+        if session is not None:
+            raise ExecutionTimeout("afterClusterTime not reached")
+        return await original(item_id, category, limit, cursor)
+
+    monkeypatch.setattr(server, "read_session", causal_session)
+    monkeypatch.setattr(server, "load_comments", load_comments)
+
+    response = client.get(
+        '/api/comments',
+        params={"item_id": item["id"], "category": "games"},
+        headers={server.READ_AFTER_HEADER: "token"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@pytest.mark.skipif(not REPLICA_SET_URL, reason="MONGO_REPLICA_SET_URL not set (see README)")
+def test_read_your_writes_against_a_replica_set(server, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    database_name = f"supergamer_test_{os.getpid()}"
+
+    async def run():
+        replica_client = AsyncIOMotorClient(REPLICA_SET_URL)
+        database = replica_client[database_name]
+        read_db = replica_client.get_database(
+            database_name, read_preference=server.READ_PREFERENCES["secondaryPreferred"]()
+        )
+        monkeypatch.setattr(server, "client", replica_client)
+        monkeypatch.setattr(server, "db", database)
+        monkeypatch.setattr(server, "read_db", read_db)
+        monkeypatch.setattr(server, "READ_ROUTING_ENABLED", True)
+        monkeypatch.setattr(server.idempotency_store, "collection", database.idempotency_keys)
+        try:
+            await server.create_admin_user()
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                login = await http.post('/api/auth/login', json={"email": "admin@supergamer.com", "password": "admin"})
+                headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+                item = await http.post('/api/items', json={
+                    "title": "Zelda", "description": "Aventura", "image_url": "https://example.com/a.png",
+                    "official_link": "https://example.com", "category": "games"
+                }, headers=headers)
+                assert item.headers.get(server.READ_AFTER_HEADER)
+                comment = await http.post('/api/comments', json={
+                    "item_id": item.json()["id"], "category": "games", "text": "Primero"
+                }, headers=headers)
+                token = comment.headers[server.READ_AFTER_HEADER]
+                comments = await http.get(
+                    '/api/comments',
+                    params={"item_id": item.json()["id"], "category": "games"},
+                    headers={server.READ_AFTER_HEADER: token}
+                )
+                assert [entry["id"] for entry in comments.json()] == [comment.json()["id"]]
+        finally:
+            await replica_client.drop_database(database_name)
+            replica_client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+import asyncio
+import json
+
+
+def test_tokenize_folds_case_and_accents(server):
+    assert server.tokenize("Pokémon: ÉPICO, aventura!") == ["pokemon", "epico", "aventura"]
+
+
+def test_index_ranks_title_matches_above_description_matches(server):
+    index = server.SearchIndex()
+    index.enabled = True
+    index.add({"id": "1", "category": "games", "title": "Batalla final", "description": "Un mundo de dragones"})
+    index.add({"id": "2", "category": "games", "title": "Dragones", "description": "Batalla por el reino"})
+    index.add({"id": "3", "category": "heroes", "title": "Dragones", "description": ""})
+
+    items, total = index.search("dragones", "games", 0, 10)
+
+    assert total == 2
+    assert [item["id"] for item in items] == ["2", "1"]
+
+
+def test_index_pages_and_forgets_removed_items(server):
+    index = server.SearchIndex()
+    index.enabled = True
+    for i in range(5):
+        index.add({"id": str(i), "category": "games", "title": "Zelda " * (i + 1), "description": ""})
+
+    items, total = index.search("zelda", "games", 2, 2)
+    assert total == 5
+    assert [item["id"] for item in items] == ["2", "1"]
+
+    index.remove("4")
+    assert index.search("zelda", "games", 0, 10)[1] == 4
+
+
+def test_concurrent_rebuilds_scan_once(server, monkeypatch):
+    loads = []
+    original = server.load_search_index
+
+    async def counting_load():
+        loads.append(1)
+        await original()
+
+    monkeypatch.setattr(server, "load_search_index", counting_load)
+
+    async def rebuild_concurrently():
+        await server.db.items.insert_one({"id": "1", "category": "games", "title": "Zelda", "description": ""})
+        await asyncio.gather(*[server.build_search_index() for _ in range(10)])
+
+    asyncio.run(rebuild_concurrently())
+
+    assert len(loads) == 1
+    assert server.search_index.enabled
+    assert server.search_index.search("zelda", "games", 0, 10)[1] == 1
+
+
+def test_search_endpoint_uses_memory_index(server, client, create_item):
+    asyncio.run(server.build_search_index())
+    create_item(title="Mario Kart", description="Carreras")
+    create_item(title="Zelda", description="Aventura con Mario de cameo")
+    create_item(title="Mario", category="heroes")
+
+    response = client.get('/api/items/search', params={"q": "mario", "category": "games"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 2
+    assert [item["title"] for item in body["items"]] == ["Mario Kart", "Zelda"]
+
+
+class FakeTextCursor:
+    def __init__(self, items):
+        self.items = items
+
+    def sort(self, *args):
+        return self
+
+    def skip(self, skip):
+        self.items = self.items[skip:]
+        return self
+
+    def limit(self, limit):
+        self.items = self.items[:limit]
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+    async def to_list(self, length):
+        return self.items
+
+
+class FakeTextCollection:
+    def __init__(self, matches):
+        self.matches = matches
+        self.count_kwargs = None
+
+    def find(self, *args, **kwargs):
+        return FakeTextCursor(list(self.matches))
+
+    async def count_documents(self, text_filter, **kwargs):
+        self.count_kwargs = kwargs
+        return min(len(self.matches), kwargs.get("limit", len(self.matches)))
+
+
+def text_search(server, monkeypatch, matches, page=1, limit=2):
+    collection = FakeTextCollection([
+        {"id": str(i), "category": "games", "title": "Zelda", "description": "", "image_url": "https://example.com/a.png",
+         "official_link": "https://example.com", "created_at": "2024-01-01T00:00:00+00:00", "score": 1.0}
+        for i in range(matches)
+    ])
+    monkeypatch.setattr(server, "read_db", type("FakeDatabase", (), {"items": collection})())
+    payload = asyncio.run(server.run_search("zelda", "games", page, limit))
+    return collection, json.loads(payload.body)
+
+
+def test_text_search_count_is_capped_and_bounded_in_time(server, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_COUNT_LIMIT", 5)
+
+    collection, results = text_search(server, monkeypatch, matches=8)
+
+    assert collection.count_kwargs == {"limit": 6, "maxTimeMS": server.MONGO_READ_DEADLINE_MS}
+    assert (results["total"], results["total_exact"]) == (5, False)
+    assert [item["id"] for item in results["items"]] == ["0", "1"]
+
+
+def test_text_search_count_is_exact_below_the_cap(server, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_COUNT_LIMIT", 5)
+
+    assert text_search(server, monkeypatch, matches=3)[1]["total"] == 3
+    assert text_search(server, monkeypatch, matches=5)[1]["total_exact"] is True
+    collection, results = text_search(server, monkeypatch, matches=8, page=4)
+    assert collection.count_kwargs["limit"] == 9
+    assert (results["total"], results["total_exact"]) == (8, True)
@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+
+import httpx
+import pytest
+
+
+def test_concurrent_callers_share_one_call(server):
+    flight = server.SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "payload"
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", load) for _ in range(10)])
+
+    assert asyncio.run(run()) == ["payload"] * 10
+    assert len(calls) == 1
+    assert flight.calls == {}
+
+
+def test_errors_reach_every_waiter_and_are_not_cached(server):
+    flight = server.SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("mongo down")
+
+    async def run():
+        results = await asyncio.gather(*[flight.do("key", failing) for _ in range(5)], return_exceptions=True)
+        retried = await flight.do("key", lambda: asyncio.sleep(0, result="ok"))
+        return results, retried
+
+    results, retried = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 1
+    assert retried == "ok"
+
+
+def test_shared_call_is_bounded_by_the_timeout(server):
+    flight = server.SingleFlight(timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(flight.do("key", lambda: asyncio.sleep(1)))
+
+
+def test_one_caller_cancelling_does_not_cancel_the_others(server):
+    flight = server.SingleFlight()
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0.05, result="done")))
+        second = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0.05, result="other")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_concurrent_catalog_requests_hit_mongo_once(server, create_item, monkeypatch):
+    create_item()
+    loads = []
+    original = server.load_catalog
+
+    async def counting_load(category, session=None):
+        loads.append(category)
+        await asyncio.sleep(0.01)
+        return await original(category, session)
+
+    monkeypatch.setattr(server, "load_catalog", counting_load)
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.get('/api/items', params={"category": "games"}) for _ in range(10)
+            ])
+
+    responses = asyncio.run(run())
+
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses}) == 1
+    assert loads == ["games"]
+
+
+def test_per_request_payloads_stay_at_the_fast_level(server):
+    body = b'{"text": "' + b"comentario " * 500 + b'"}'
+
+    async def encode():
+        payload = server.CachedPayload(body, best=False)
+        encoded, encoding = payload.encoded("gzip")
+        await asyncio.sleep(0.05)
+        return payload, encoded, encoding
+
+    payload, encoded, encoding = asyncio.run(encode())
+
+    assert encoding == "gzip"
+    assert gzip.decompress(encoded) == body
+    assert payload.variants == {"gzip": encoded}
+    assert payload.upgrading == set()
@@ -0,0 +1,111 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def publisher(server, tmp_path):
+    return server.SnapshotPublisher(tmp_path, page_size=2, keep_versions=2)
+
+
+def read_manifest(publisher):
+    return json.loads((publisher.directory / "manifest.json").read_bytes())
+
+
+def read_json(publisher, manifest, path):
+    return json.loads((publisher.directory / manifest["base"] / path).read_bytes())
+
+
+def test_catalog_is_split_into_pages_under_a_versioned_base(server, publisher, create_item):
+    ids = [create_item(title=f"Juego {i}")["id"] for i in range(5)]
+    hero = create_item(title="Héroe", category="heroes")
+
+    assert asyncio.run(publisher.publish()) is True
+
+    manifest = read_manifest(publisher)
+    games = manifest["categories"]["games"]
+    assert manifest["base"] == f"{manifest['version']}/"
+    assert (games["count"], games["pages"]) == (5, 3)
+    assert [item["id"] for item in read_json(publisher, manifest, games["path"])] == ids
+    pages = [read_json(publisher, manifest, games["page_path"].format(page=page)) for page in (1, 2, 3)]
+    assert [[item["id"] for item in page] for page in pages] == [ids[:2], ids[2:4], ids[4:]]
+    assert [item["id"] for item in read_json(publisher, manifest, "items/heroes.json")] == [hero["id"]]
+
+
+def test_unchanged_catalog_keeps_the_published_version(server, publisher, create_item):
+    create_item()
+    asyncio.run(publisher.publish())
+    first = read_manifest(publisher)
+
+    asyncio.run(publisher.publish())
+    assert read_manifest(publisher) == first
+
+    create_item(title="Otro")
+    asyncio.run(publisher.publish())
+    assert read_manifest(publisher)["version"] != first["version"]
+
+
+def test_compressed_variants_only_above_the_minimum_size(server, publisher, create_item, monkeypatch):
+    for i in range(3):
+        create_item(title=f"Juego {i}", description="Aventura " * 20)
+    monkeypatch.setattr(server, "COMPRESSION_MIN_SIZE", 1000)
+
+    asyncio.run(publisher.publish())
+
+    base = publisher.directory / read_manifest(publisher)["base"]
+    full, page = base / "items/games.json", base / "items/games/page-2.json"
+    assert full.stat().st_size >= 1000 > page.stat().st_size
+    assert gzip.decompress((base / "items/games.json.gz").read_bytes()) == full.read_bytes()
+    assert ("br" in server.SUPPORTED_ENCODINGS) == (base / "items/games.json.br").exists()
+    assert not (base / "items/games/page-2.json.gz").exists()
+
+
+def test_old_versions_are_pruned(server, publisher, create_item):
+    for i in range(4):
+        create_item(title=f"Juego {i}")
+        asyncio.run(publisher.publish())
+
+    versions = {path.name for path in publisher.directory.iterdir() if path.is_dir()}
+    assert len(versions) == publisher.keep_versions
+    assert read_manifest(publisher)["version"] in versions
+
+
+def test_unsafe_categories_are_skipped(server, publisher, create_item):
+    item = create_item()
+    asyncio.run(server.db.items.insert_one({**item, "id": "malo", "category": "../fuera"}))
+
+    asyncio.run(publisher.publish())
+
+    assert set(read_manifest(publisher)["categories"]) == {"games"}
+    assert not (publisher.directory.parent / "fuera.json").exists()
+
+
+def test_publishing_waits_for_the_lease_and_releases_it(server, publisher, create_item):
+    create_item()
+    asyncio.run(server.db.job_leases.insert_one({
+        "_id": "snapshot_publish",
+        "owner": "otro-worker",
+        "locked_until": datetime.now(timezone.utc) + timedelta(minutes=1),
+    }))
+
+    assert asyncio.run(publisher.publish()) is False
+    assert not (publisher.directory / "manifest.json").exists()
+
+    asyncio.run(server.db.job_leases.delete_many({}))
+    assert asyncio.run(publisher.publish()) is True
+    assert asyncio.run(server.db.job_leases.count_documents({})) == 0
+
+
+def test_a_manifest_from_a_later_scan_is_never_replaced(server, publisher, create_item):
+    create_item()
+    newer = {"version": "posterior", "generated_at": (datetime.now(timezone.utc) + timedelta(minutes=1)).isoformat()}
+    publisher.directory.mkdir(parents=True, exist_ok=True)
+    (publisher.directory / "manifest.json").write_text(json.dumps(newer))
+
+    asyncio.run(publisher.publish())
+
+    assert read_manifest(publisher) == newer
+    assert publisher.current_version is None
@@ -0,0 +1,126 @@
+import asyncio
+import io
+import os
+import random
+import threading
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+class CountingFetcher:
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self.calls = 0
+
+    async def fetch(self, url):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return await self.fetcher.fetch(url)
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    directory = tmp_path / "sources"
+    (directory / "covers").mkdir(parents=True)
+    Image.new("RGB", (1200, 800), (200, 30, 30)).save(directory / "covers" / "zelda.png")
+    return directory
+
+
+def make_service(server, source_dir, cache_dir, max_bytes=10 * 1024 * 1024):
+    fetcher = CountingFetcher(server.LocalImageFetcher(source_dir))
+    return server.ThumbnailService(fetcher, server.ThumbnailCache(cache_dir, max_bytes)), fetcher
+
+
+def test_thumbnail_is_resized_and_served_from_disk_cache(server, source_dir, tmp_path):
+    service, fetcher = make_service(server, source_dir, tmp_path / "cache")
+
+    async def get_twice():
+        first = await service.get("https://cdn.example.com/covers/zelda.png", "sm", "jpeg")
+        second = await service.get("https://cdn.example.com/covers/zelda.png", "sm", "jpeg")
+        return first, second
+
+    (data, digest), (cached, cached_digest) = asyncio.run(get_twice())
+
+    assert fetcher.calls == 1
+    assert cached == data and cached_digest == digest
+    with Image.open(io.BytesIO(data)) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert max(thumbnail.size) == server.THUMBNAIL_SIZES["sm"]
+    assert service.cache.path_for(digest).is_file()
+
+
+def test_concurrent_requests_render_once(server, source_dir, tmp_path):
+    service, fetcher = make_service(server, source_dir, tmp_path / "cache")
+
+    async def get_concurrently():
+        return await asyncio.gather(*[
+            service.get("/covers/zelda.png", "md", "webp") for _ in range(10)
+        ])
+
+    results = asyncio.run(get_concurrently())
+
+    assert fetcher.calls == 1
+    assert len({data for data, _ in results}) == 1
+
+
+def test_local_fetcher_rejects_paths_outside_its_root(server, source_dir):
+    fetcher = server.LocalImageFetcher(source_dir / "covers")
+
+    with pytest.raises(server.ImageFetchError):
+        asyncio.run(fetcher.fetch("https://cdn.example.com/../covers/zelda.png/../../etc/passwd"))
+    with pytest.raises(server.ImageFetchError):
+        asyncio.run(fetcher.fetch("/missing.png"))
+
+
+def test_cache_evicts_least_recently_used(server, tmp_path):
+    cache = server.ThumbnailCache(tmp_path / "cache", max_bytes=250)
+    cache.put("a" * 64, b"x" * 100)
+    cache.put("b" * 64, b"x" * 100)
+    assert cache.get("a" * 64) is not None
+
+    cache.put("c" * 64, b"x" * 100)
+
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) is not None
+    assert not cache.path_for("b" * 64).exists()
+    assert cache.total_bytes == 200
+
+
+def test_cache_reload_rebuilds_the_index_from_disk(server, tmp_path):
+    cache = server.ThumbnailCache(tmp_path / "cache", max_bytes=1000)
+    cache.put("a" * 64, b"x" * 100)
+
+    reloaded = server.ThumbnailCache(tmp_path / "cache", max_bytes=1000)
+    reloaded.load()
+
+    assert reloaded.total_bytes == 100
+    assert reloaded.get("a" * 64) == b"x" * 100
+
+
+def test_cache_bookkeeping_survives_concurrent_threads(server, tmp_path):
+    cache = server.ThumbnailCache(tmp_path / "cache", max_bytes=50_000)
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(300):
+                digest = f"{rng.randrange(40):064x}"
+                if rng.random() < 0.5:
+                    cache.put(digest, os.urandom(rng.randrange(500, 3000)))
+                else:
+                    cache.get(digest)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.total_bytes == sum(cache.entries.values())
+    assert cache.total_bytes <= cache.max_bytes
@@ -0,0 +1,105 @@
+import asyncio
+
+
+def test_top_items_follow_weighted_scores(server):
+    tracker = server.TrendingTracker(3600, top_k=3, max_tracked=100)
+    for _ in range(3):
+        tracker.record("vistas", "games", "view")
+    tracker.record("comentado", "games", "comment")
+    tracker.record("otro", "heroes", "view")
+
+    assert tracker.top_items("games", 10) == ["comentado", "vistas"]
+    assert tracker.top_items("heroes", 10) == ["otro"]
+
+
+def test_tracked_items_stay_bounded_across_categories(server):
+    tracker = server.TrendingTracker(3600, top_k=5, max_tracked=100, max_categories=20)
+    for i in range(20_000):
+        tracker.record(f"item-{i}", f"categoria-{i}", "view")
+
+    assert len(tracker.scores) <= 20
+    assert len(tracker.top) <= 20
+    assert tracker.tracked <= 100
+    assert tracker.tracked == sum(len(scores) for scores in tracker.scores.values())
+
+
+def test_pruning_keeps_the_strongest_items(server):
+    tracker = server.TrendingTracker(3600, top_k=5, max_tracked=100)
+    for _ in range(10):
+        tracker.record("favorito", "games", "view")
+    for i in range(5_000):
+        tracker.record(f"item-{i}", "games", "view")
+
+    assert tracker.tracked <= 100
+    assert tracker.top_items("games", 1) == ["favorito"]
+
+
+def test_removed_items_drop_emptied_categories(server):
+    tracker = server.TrendingTracker(3600, top_k=5, max_tracked=100)
+    tracker.record("unico", "games", "view")
+
+    tracker.remove("unico")
+
+    assert tracker.scores == {} and tracker.top == {}
+    assert tracker.pending_views == {}
+
+
+def test_many_pending_views_wake_the_flush(server):
+    tracker = server.TrendingTracker(3600, top_k=5, max_tracked=10_000, max_pending_views=100)
+    for i in range(99):
+        tracker.record(f"item-{i}", "games", "view")
+    assert not tracker.flush_needed.is_set()
+
+    tracker.record("item-99", "games", "view")
+
+    assert tracker.flush_needed.is_set()
+
+
+def test_flush_writes_view_counts(server, create_item):
+    item = create_item()
+    for _ in range(3):
+        server.trending.record(item["id"], "games", "view")
+
+    asyncio.run(server.trending.flush_views())
+
+    stored = asyncio.run(server.db.items.find_one({"id": item["id"]}))
+    assert stored["view_count"] == 3
+    assert server.trending.pending_views == {}
+
+
+def test_views_are_only_counted_for_known_items(server, client, create_item):
+    item = create_item()
+
+    assert client.post(f'/api/items/{item["id"]}/view', params={"category": "games"}).status_code == 202
+    assert client.post('/api/items/inventado/view', params={"category": "games"}).status_code == 404
+    assert client.post(f'/api/items/{item["id"]}/view', params={"category": "otra"}).status_code == 422
+    assert client.post(f'/api/items/{item["id"]}/view', params={"category": "heroes"}).status_code == 404
+
+    assert dict(server.trending.pending_views) == {item["id"]: 1}
+
+
+def test_trending_endpoint_returns_ranked_items(server, client, create_item):
+    first = create_item(title="Primero")
+    second = create_item(title="Segundo")
+    for _ in range(2):
+        client.post(f'/api/items/{second["id"]}/view', params={"category": "games"})
+    client.post(f'/api/items/{first["id"]}/view', params={"category": "games"})
+
+    response = client.get('/api/items/trending', params={"category": "games"})
+
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()][:2] == [second["id"], first["id"]]
+
+
+def test_comments_on_unknown_items_do_not_feed_trending(server, client, admin_headers, create_item, monkeypatch):
+    monkeypatch.setattr(server, "trending", server.TrendingTracker(3600, top_k=5, max_tracked=100, max_categories=2))
+    item = create_item()
+    for category, item_id in (("basura-1", "x"), ("basura-2", "y"), ("games", "inventado")):
+        response = client.post('/api/comments', json={"item_id": item_id, "category": category, "text": "hola"}, headers=admin_headers)
+        assert response.status_code == 200
+    assert server.trending.scores == {}
+
+    client.post('/api/comments', json={"item_id": item["id"], "category": "games", "text": "hola"}, headers=admin_headers)
+    assert client.post(f'/api/items/{item["id"]}/view', params={"category": "games"}).status_code == 202
+
+    assert server.trending.top_items("games", 10) == [item["id"]]